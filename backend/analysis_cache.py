@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import ASCENDING
+from pymongo.database import Collection
+
+from structs import LlmAnalysis
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def cache_key(title: str, text: str, system_prompt: str, model_id: str) -> str:
+    # The prompt is hashed on its own so editing it changes its "version"
+    prompt_version = hashlib.sha256(system_prompt.encode()).hexdigest()
+    digest = hashlib.sha256()
+    for part in [normalize(title), normalize(text), prompt_version, model_id]:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """LLM analyses keyed by what was sent to the model, not by URL.
+
+    The same article under a different URL costs a lookup instead of an
+    inference. The least recently used entries are evicted once the cache
+    holds more than ``max_entries``.
+    """
+
+    collection: Collection
+    max_entries: int
+    evict_every: int
+    stats: Counter
+
+    def __init__(
+        self, collection: Collection, max_entries: int = 50_000, evict_every: int = 100
+    ):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.collection.create_index([("last_used", ASCENDING)])
+
+    def get(self, key: str) -> Optional[LlmAnalysis]:
+        entry = self.collection.find_one_and_update(
+            {"_id": key},
+            {"$set": {"last_used": datetime.now(timezone.utc)}, "$inc": {"hits": 1}},
+        )
+        with self.lock:
+            self.stats["hits" if entry else "misses"] += 1
+        if not entry:
+            return None
+        return LlmAnalysis(
+            takeaways=entry["takeaways"], search_terms=set(entry["search_terms"])
+        )
+
+    def put(self, key: str, llm_analysis: LlmAnalysis):
+        now = datetime.now(timezone.utc)
+        self.collection.update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "takeaways": llm_analysis.takeaways,
+                    "search_terms": list(llm_analysis.search_terms),
+                    "last_used": now,
+                },
+                "$setOnInsert": {"created_at": now, "hits": 0},
+            },
+            upsert=True,
+        )
+        with self.lock:
+            self.stats["puts"] += 1
+            evict = self.stats["puts"] % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        excess = self.collection.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return
+        oldest = self.collection.find(
+            {}, projection={"_id": 1}, sort=[("last_used", ASCENDING)], limit=excess
+        )
+        result = self.collection.delete_many({"_id": {"$in": [e["_id"] for e in oldest]}})
+        logging.info("Evicted %d cached analyses", result.deleted_count)
+
+    def log(self, logger: logging.Logger):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            logger.info(
+                "Analysis cache: %d hits, %d misses (%.0f%% hit rate)",
+                self.stats["hits"],
+                self.stats["misses"],
+                self.stats["hits"] / lookups * 100 if lookups else 0.0,
+            )
@@ -1,7 +1,18 @@
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, MongoClient
 from pymongo.database import Collection
-from flask import Flask, jsonify, make_response
+from flask import Flask, Response, jsonify, make_response, request, stream_with_context
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+import base64
+import gzip
+import hashlib
+import json
 import logging
+import queue
+import threading
+import time
+
+from change_feed import ChangeFeed
 
 app = Flask(__name__)
 client = MongoClient("mongodb://localhost:27017/")
@@ -9,6 +20,143 @@ db = client["dolores"]
 metadata_collection: Collection = db["page_metadata"]
 content_collection: Collection = db["page_content"]
 analysis_collection: Collection = db["page_analysis"]
+# Every analyzed article, joined at write time by the analyzer's FeedView
+feed_collection: Collection = db["feed"]
+schedule_collection: Collection = db["schedule"]
+
+# Everything the pipeline remembers about articles it has processed
+INGESTION_STATE = [
+    "jobs",
+    "pipeline_state",
+    "feed_state",
+    "page_html",
+    "hn_seen",
+    "hn_verdicts",
+    "stories",
+    "story_members",
+    "story_terms",
+]
+
+# Newest first, with _id breaking ties so cursors are stable
+FEED_ORDER = [("date", DESCENDING), ("_id", DESCENDING)]
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Seconds a serialized response is reused while the feed doesn't change
+CACHE_TTL = 60
+# Smaller responses aren't worth the CPU
+GZIP_MIN_SIZE = 1024
+# Seconds between comments on an idle event stream, so dead clients are noticed
+KEEPALIVE_INTERVAL = 15
+# Articles a /stream client may fall behind by before it is disconnected
+STREAM_BACKLOG = 1000
+
+
+class ResponseCache:
+    """Serialized response bodies, keyed by request and the feed version they show."""
+
+    ttl: float
+    entries: dict[tuple, tuple[float, bytes, bool]]
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[tuple[bytes, bool]]:
+        """Returns the body and whether it is gzipped, if it is cached."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(key, None)
+                return None
+            return entry[1], entry[2]
+
+    def put(self, key: tuple, body: bytes, gzipped: bool):
+        with self.lock:
+            # Entries for older feed versions are never asked for again
+            now = time.monotonic()
+            self.entries = {k: v for k, v in self.entries.items() if v[0] >= now}
+            self.entries[key] = (now + self.ttl, body, gzipped)
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+
+response_cache = ResponseCache(CACHE_TTL)
+
+
+class Subscription:
+    articles: queue.Queue
+    # Set when the client fell too far behind and was cut off
+    dropped: bool
+
+    def __init__(self, backlog: int):
+        self.articles = queue.Queue(backlog)
+        self.dropped = False
+
+
+class FeedBroadcast:
+    """Follows the feed once per process and hands new articles to every /stream client.
+
+    The follower thread starts with the first subscriber, so however many
+    clients are connected, there is one change stream or poll loop.
+    """
+
+    collection: Collection
+    subscribers: set[Subscription]
+    thread: Optional[threading.Thread]
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+        self.subscribers = set()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(STREAM_BACKLOG)
+        with self.lock:
+            self.subscribers.add(subscription)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="feed-broadcast", daemon=True
+                )
+                self.thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, article: dict):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.articles.put_nowait(article)
+            except queue.Full:
+                # It reconnects with its Last-Event-ID and catches up from the database
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+    def run(self):
+        feed = ChangeFeed(
+            self.collection,
+            None,
+            "api-stream",
+            watermark_field="analyzed_at",
+            poll_interval=5,
+        )
+        while True:
+            try:
+                for article in feed.follow():
+                    self.publish(article)
+            except Exception as e:
+                logging.error("Failed to follow the feed: %s", e)
+                time.sleep(5)
+
+
+feed_broadcast = FeedBroadcast(feed_collection)
 
 
 # Add CORS headers to every response
@@ -20,44 +168,301 @@ def add_cors_headers(response):
     return response
 
 
+@app.after_request
+def compress_response(response: Response):
+    if (
+        response.status_code != 200
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or "gzip" not in request.headers.get("Accept-Encoding", "")
+        or response.content_length is None
+        or response.content_length < GZIP_MIN_SIZE
+    ):
+        return response
+    response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def utc_timestamp(value: str) -> str:
+    """Normalizes an ISO timestamp to the UTC form timestamps are stored in.
+
+    Stored timestamps only compare correctly, as strings, against that form.
+    Times without an offset are taken as UTC. Raises ValueError.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+
+def feed_version() -> tuple[str, Optional[datetime]]:
+    """A cheap stand-in for the feed's contents: its size and newest analysis."""
+    latest = feed_collection.find_one(
+        sort=[("analyzed_at", DESCENDING)], projection={"analyzed_at": 1}
+    )
+    analyzed_at = latest.get("analyzed_at") if latest else None
+    count = feed_collection.estimated_document_count()
+    last_modified = datetime.fromisoformat(analyzed_at) if analyzed_at else None
+    return f"{count}:{analyzed_at}", last_modified
+
+
+def cached_json(compute: Callable[[], Any]) -> Response:
+    """Answers from the response cache, or with a 304, whenever the feed hasn't changed."""
+    version, last_modified = feed_version()
+    etag = hashlib.sha1(f"{version}|{request.full_path}".encode()).hexdigest()
+
+    not_modified = request.if_none_match.contains_weak(etag)
+    if not request.if_none_match and last_modified and request.if_modified_since:
+        # HTTP dates have no fractional seconds
+        not_modified = last_modified.replace(microsecond=0) <= request.if_modified_since
+
+    if not_modified:
+        response = make_response("", 304)
+    else:
+        accepts_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+        key = (request.full_path, version, accepts_gzip)
+        cached = response_cache.get(key)
+        if cached is None:
+            body = app.json.dumps(compute()).encode()
+            gzipped = accepts_gzip and len(body) >= GZIP_MIN_SIZE
+            if gzipped:
+                body = gzip.compress(body, compresslevel=6)
+            response_cache.put(key, body, gzipped)
+        else:
+            body, gzipped = cached
+
+        response = make_response(body)
+        response.content_type = "application/json"
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+
+    # Weak, since gzipped and plain bodies share it
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    # Let clients keep a copy, but check it with us every time
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route("/all", methods=["GET"])
 def get_all():
-    pipeline = [
-        {
-            "$lookup": {
-                "from": "page_content",
-                "localField": "_id",
-                "foreignField": "_id",
-                "as": "temp1",
+    return cached_json(
+        lambda: group_duplicates(list(feed_collection.find().sort(FEED_ORDER)))
+    )
+
+
+def group_duplicates(results: list[dict]) -> list[dict]:
+    # Near-duplicates are listed under their original instead of on their own
+    by_id = {result["_id"]: result for result in results}
+    grouped = []
+    for result in results:
+        original = by_id.get(result.get("duplicate_of"))
+        if original is None:
+            result.setdefault("duplicates", [])
+            grouped.append(result)
+            continue
+        original.setdefault("duplicates", []).append(
+            {
+                "url": result["url"],
+                "source": result["source"],
+                "discussion_url": result["discussion_url"],
             }
-        },
-        {"$unwind": "$temp1"},
-        {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$$ROOT", "$temp1"]}}},
-        {
-            "$lookup": {
-                "from": "page_analysis",
-                "localField": "_id",
-                "foreignField": "_id",
-                "as": "temp2",
+        )
+    return grouped
+
+
+def encode_cursor(article: dict) -> str:
+    return base64.urlsafe_b64encode(
+        json.dumps([article["date"], article["_id"]]).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    date, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return date, id
+
+
+def find_duplicates(ids: list[str]) -> dict[str, list[dict]]:
+    """Lists the near-duplicates of each of ``ids``, the way group_duplicates does."""
+    duplicates: dict[str, list[dict]] = {id: [] for id in ids}
+    for duplicate in feed_collection.find(
+        {"duplicate_of": {"$in": ids}},
+        projection={"duplicate_of": 1, "url": 1, "source": 1, "discussion_url": 1},
+    ):
+        duplicates[duplicate["duplicate_of"]].append(
+            {
+                "url": duplicate["url"],
+                "source": duplicate["source"],
+                "discussion_url": duplicate["discussion_url"],
             }
-        },
-        {"$unwind": "$temp2"},
-        {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$$ROOT", "$temp2"]}}},
-        {"$project": {"temp1": 0, "temp2": 0}},
-    ]
+        )
+    return duplicates
+
+
+@app.route("/feed", methods=["GET"])
+def get_feed():
+    """Analyzed articles, newest first, a page at a time.
+
+    Query parameters: ``since`` (ISO date), ``source`` (comma-separated),
+    ``limit``, ``cursor`` (the ``next`` of the previous page) and
+    ``text=1`` to include article text.
+    """
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        cursor = request.args.get("cursor")
+        after: Optional[tuple[str, str]] = decode_cursor(cursor) if cursor else None
+        since = request.args.get("since")
+        if since:
+            since = utc_timestamp(since)
+    except (ValueError, TypeError) as e:
+        return make_response(
+            jsonify({"error": f"bad limit, cursor or since: {e}"}), 400
+        )
+
+    # Duplicates are listed under their originals instead
+    conditions: list[dict] = [{"duplicate_of": None}]
+    if since:
+        conditions.append({"date": {"$gte": since}})
+    if request.args.get("source"):
+        conditions.append({"source": {"$in": request.args["source"].split(",")}})
+    if after:
+        date, id = after
+        conditions.append(
+            {"$or": [{"date": {"$lt": date}}, {"date": date, "_id": {"$lt": id}}]}
+        )
+
+    projection = None if request.args.get("text") == "1" else {"text": 0}
+
+    def page() -> dict:
+        articles = list(
+            feed_collection.find({"$and": conditions}, projection=projection)
+            .sort(FEED_ORDER)
+            .limit(limit)
+        )
+
+        duplicates = find_duplicates([article["_id"] for article in articles])
+        for article in articles:
+            article["duplicates"] = duplicates[article["_id"]]
 
-    results = list(metadata_collection.aggregate(pipeline))
-    return make_response(jsonify(results))
+        next_cursor = encode_cursor(articles[-1]) if len(articles) == limit else None
+        return {"articles": articles, "next": next_cursor}
+
+    return cached_json(page)
+
+
+@app.route("/article", methods=["GET"])
+# IDs are URLs, so keep their double slashes
+@app.route("/article/<path:article_id>", methods=["GET"], merge_slashes=False)
+def get_article(article_id: Optional[str] = None):
+    """One analyzed article, by its ID in the ``id`` query parameter.
+
+    IDs are URLs, so they must be percent-encoded. The ID can also follow
+    ``/article/``, but only IDs without a query string survive that.
+    """
+    article_id = request.args.get("id") or article_id
+    if not article_id:
+        return make_response(jsonify({"error": "missing id"}), 400)
+
+    article = feed_collection.find_one({"_id": article_id})
+    if article is None:
+        return make_response(jsonify({"error": "not found"}), 404)
+
+    article["duplicates"] = find_duplicates([article_id])[article_id]
+    return make_response(jsonify(article))
+
+
+@app.route("/stream", methods=["GET"])
+def stream_feed():
+    """Pushes each newly analyzed article as a server-sent event.
+
+    Event IDs are analysis times. A reconnecting client's ``Last-Event-ID``,
+    or the ``after`` query parameter on the first connection, replays
+    whatever was analyzed since. ``text=1`` includes article text.
+
+    Every open stream holds a request worker for as long as its client is
+    connected, so serve the API from gevent workers rather than a few
+    processes. With gevent installed, for example::
+
+        uwsgi --http :3000 --wsgi-file api.py --callable app \\
+            --gevent 1000 --gevent-monkey-patch
+    """
+    after = request.headers.get("Last-Event-ID") or request.args.get("after")
+    if after:
+        # Checked before the stream starts, while a 400 can still be sent
+        try:
+            after = utc_timestamp(after)
+        except ValueError as e:
+            return make_response(jsonify({"error": f"bad event ID: {e}"}), 400)
+    include_text = request.args.get("text") == "1"
+
+    def event(article: dict) -> str:
+        # Articles are shared between every client's stream
+        if not include_text:
+            article = {key: value for key, value in article.items() if key != "text"}
+        return f"id: {article['analyzed_at']}\ndata: {app.json.dumps(article)}\n\n"
+
+    def events():
+        # Subscribe before catching up, so nothing analyzed in between is missed
+        subscription = feed_broadcast.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            replayed = set()
+            if after:
+                for article in feed_collection.find(
+                    {"analyzed_at": {"$gt": after}}
+                ).sort("analyzed_at", ASCENDING):
+                    replayed.add(article["_id"])
+                    yield event(article)
+
+            while not subscription.dropped:
+                try:
+                    article = subscription.articles.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if article["_id"] not in replayed:
+                    yield event(article)
+        finally:
+            feed_broadcast.unsubscribe(subscription)
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop reverse proxies from holding events back
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/schedule", methods=["GET"])
+def get_schedule():
+    # When each poller last decided to run next, and the rate that decision was based on
+    schedule = list(schedule_collection.find().sort("next_run_at", 1))
+    return make_response(jsonify(schedule))
 
 
 @app.route("/clear", methods=["POST"])
 def clear_all():
+    response_cache.clear()
+    result = feed_collection.delete_many({})
+    logging.info("Deleted %d feed documents", result.deleted_count)
     result = analysis_collection.delete_many({})
     logging.info("Deleted %d analysis documents", result.deleted_count)
     result = content_collection.delete_many({})
     logging.info("Deleted %d content documents", result.deleted_count)
     result = metadata_collection.delete_many({})
     logging.info("Deleted %d metadata documents", result.deleted_count)
+
+    # Ingestion state too, or done jobs and seen IDs would keep re-ingested
+    # articles from ever being parsed or analyzed again. The analysis cache
+    # and the learned schedule stay. Watchers keep recently seen URLs in
+    # memory, so restart them to re-ingest those.
+    for name in INGESTION_STATE:
+        result = db[name].delete_many({})
+        logging.info("Deleted %d %s documents", result.deleted_count, name)
     return make_response(jsonify({}))
 
 
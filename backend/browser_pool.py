@@ -0,0 +1,342 @@
+import asyncio
+import contextlib
+import dataclasses
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Callable, Optional
+
+from playwright.async_api import Browser as AsyncBrowser
+from playwright.async_api import BrowserContext as AsyncBrowserContext
+from playwright.async_api import Page as AsyncPage
+from playwright.async_api import Playwright as AsyncPlaywright
+from playwright.sync_api import Browser, BrowserContext, Page, Playwright, sync_playwright
+
+from navigation import PageTraffic, watch, watch_async
+
+
+@dataclasses.dataclass
+class PoolStats:
+    checkouts: int = 0
+    navigations: int = 0
+    failures: int = 0
+    recycles: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    started: float = dataclasses.field(default_factory=time.monotonic)
+    lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def record_checkout(self, wait: float):
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def record_navigation(self, failed: bool):
+        with self.lock:
+            self.navigations += 1
+            if failed:
+                self.failures += 1
+
+    def record_recycle(self):
+        with self.lock:
+            self.recycles += 1
+
+    def average_wait(self) -> float:
+        return self.total_wait / self.checkouts if self.checkouts else 0.0
+
+    def navigations_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.navigations / elapsed if elapsed > 0 else 0.0
+
+    def log(self, logger: logging.Logger):
+        logger.info(
+            "Browser pool: %d navigations (%.2f/s), %d failed, %d recycled, "
+            "wait avg %.2fs max %.2fs",
+            self.navigations,
+            self.navigations_per_second(),
+            self.failures,
+            self.recycles,
+            self.average_wait(),
+            self.max_wait,
+        )
+
+
+class BrowserSlot:
+    """One Chromium browser and the page currently being reused inside it."""
+
+    playwright: Playwright
+    lightweight: bool
+    browser: Optional[Browser]
+    context: Optional[BrowserContext]
+    page: Optional[Page]
+    traffic: Optional[PageTraffic]
+    navigations: int
+
+    def __init__(self, playwright: Playwright, lightweight: bool):
+        self.playwright = playwright
+        self.lightweight = lightweight
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.traffic = None
+        self.navigations = 0
+
+    def healthy(self) -> bool:
+        return (
+            self.browser is not None
+            and self.browser.is_connected()
+            and self.page is not None
+            and not self.page.is_closed()
+        )
+
+    def checkout(self, max_navigations: int, stats: PoolStats) -> Page:
+        if self.page is not None and (
+            self.navigations >= max_navigations or not self.healthy()
+        ):
+            self.recycle()
+            stats.record_recycle()
+
+        if self.browser is None or not self.browser.is_connected():
+            self.close_browser()
+            self.browser = self.playwright.chromium.launch()
+
+        if self.page is None:
+            self.context = self.browser.new_context()
+            self.traffic = watch(self.context, self.lightweight)
+            self.page = self.context.new_page()
+            self.navigations = 0
+        elif self.traffic is not None:
+            # Everything since the last navigation, idle time included
+            self.traffic.report(self.page.url)
+
+        self.navigations += 1
+        return self.page
+
+    def recycle(self):
+        if self.traffic is not None and self.page is not None:
+            self.traffic.report(self.page.url)
+        self.traffic = None
+        # A fresh context drops cookies, cache and any state a bad page left behind
+        if self.context is not None:
+            try:
+                self.context.close()
+            except Exception as e:
+                logging.warning("Failed to close browser context: %s", e)
+        self.context = None
+        self.page = None
+
+    def close_browser(self):
+        self.recycle()
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception as e:
+                logging.warning("Failed to close browser: %s", e)
+        self.browser = None
+
+
+class BrowserPool:
+    """A fixed set of long-lived Chromium browsers that pages are checked out of.
+
+    Playwright's sync API is bound to the thread that started it, so every
+    browser lives on its own worker thread. Callers submit a function that
+    receives a checked-out page instead of carrying the page across threads.
+    """
+
+    browsers: int
+    max_navigations: int
+    lightweight: bool
+    stats: PoolStats
+
+    def __init__(
+        self, browsers: int = 5, max_navigations: int = 50, lightweight: bool = True
+    ):
+        self.browsers = browsers
+        self.max_navigations = max_navigations
+        self.lightweight = lightweight
+        self.stats = PoolStats()
+        self.queue: queue.Queue = queue.Queue()
+        self.threads: list[threading.Thread] = []
+        for i in range(browsers):
+            thread = threading.Thread(name=f"browser-{i}", target=self.worker_loop)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, fn: Callable[..., Any], *args) -> Future:
+        future: Future = Future()
+        self.queue.put((fn, args, future, time.monotonic()))
+        return future
+
+    def worker_loop(self):
+        with sync_playwright() as p:
+            slot = BrowserSlot(p, self.lightweight)
+            try:
+                while True:
+                    work = self.queue.get()
+                    if work is None:
+                        return
+
+                    fn, args, future, queued = work
+                    if not future.set_running_or_notify_cancel():
+                        continue
+
+                    self.stats.record_checkout(time.monotonic() - queued)
+                    try:
+                        page = slot.checkout(self.max_navigations, self.stats)
+                        future.set_result(fn(page, *args))
+                        self.stats.record_navigation(failed=False)
+                    except Exception as e:
+                        # Never hand a page that failed mid-navigation to the next caller
+                        slot.recycle()
+                        self.stats.record_navigation(failed=True)
+                        future.set_exception(e)
+            finally:
+                slot.close_browser()
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class AsyncBrowserPool:
+    """Browsers x reusable pages for the asyncio engine.
+
+    Unlike the sync pool, a single event loop can drive every page at once,
+    so each browser holds several pages and callers check one out with
+    ``async with pool.page() as page``.
+    """
+
+    browsers: int
+    pages_per_browser: int
+    max_navigations: int
+    lightweight: bool
+    stats: PoolStats
+
+    def __init__(
+        self,
+        browsers: int = 2,
+        pages_per_browser: int = 25,
+        max_navigations: int = 50,
+        lightweight: bool = True,
+    ):
+        self.browsers = browsers
+        self.pages_per_browser = pages_per_browser
+        self.max_navigations = max_navigations
+        self.lightweight = lightweight
+        self.stats = PoolStats()
+        self.idle: asyncio.Queue = asyncio.Queue()
+        self.all_browsers: list[AsyncBrowser] = []
+        self.launch_locks: list[asyncio.Lock] = []
+        self.playwright: Optional[AsyncPlaywright] = None
+
+    async def start(self, playwright: AsyncPlaywright):
+        self.playwright = playwright
+        for i in range(self.browsers):
+            self.all_browsers.append(await playwright.chromium.launch())
+            self.launch_locks.append(asyncio.Lock())
+            for _ in range(self.pages_per_browser):
+                self.idle.put_nowait(AsyncPageSlot(i, self.lightweight))
+
+    async def connected_browser(self, index: int) -> AsyncBrowser:
+        # Every slot of a crashed browser lands here; only the first relaunches it
+        async with self.launch_locks[index]:
+            browser = self.all_browsers[index]
+            if not browser.is_connected():
+                assert self.playwright is not None
+                logging.warning("Browser %d disconnected, relaunching", index)
+                try:
+                    await browser.close()
+                except Exception as e:
+                    logging.warning("Failed to close browser: %s", e)
+                browser = await self.playwright.chromium.launch()
+                self.all_browsers[index] = browser
+            return browser
+
+    @contextlib.asynccontextmanager
+    async def page(self) -> AsyncIterator[AsyncPage]:
+        queued = time.monotonic()
+        slot: AsyncPageSlot = await self.idle.get()
+        self.stats.record_checkout(time.monotonic() - queued)
+        try:
+            browser = await self.connected_browser(slot.index)
+            page = await slot.checkout(browser, self.max_navigations, self.stats)
+            yield page
+            self.stats.record_navigation(failed=False)
+        except BaseException:
+            self.stats.record_navigation(failed=True)
+            await slot.recycle()
+            raise
+        finally:
+            self.idle.put_nowait(slot)
+
+    async def close(self):
+        for browser in self.all_browsers:
+            try:
+                await browser.close()
+            except Exception as e:
+                logging.warning("Failed to close browser: %s", e)
+        self.all_browsers = []
+
+
+class AsyncPageSlot:
+    index: int
+    browser: Optional[AsyncBrowser]
+    lightweight: bool
+    context: Optional[AsyncBrowserContext]
+    page: Optional[AsyncPage]
+    traffic: Optional[PageTraffic]
+    navigations: int
+
+    def __init__(self, index: int, lightweight: bool):
+        # Which of the pool's browsers this page lives in
+        self.index = index
+        self.browser = None
+        self.lightweight = lightweight
+        self.context = None
+        self.page = None
+        self.traffic = None
+        self.navigations = 0
+
+    async def checkout(
+        self, browser: AsyncBrowser, max_navigations: int, stats: PoolStats
+    ) -> AsyncPage:
+        if self.page is not None and (
+            self.navigations >= max_navigations
+            or self.page.is_closed()
+            # The browser was relaunched, so this page died with the old one
+            or browser is not self.browser
+        ):
+            await self.recycle()
+            stats.record_recycle()
+
+        if self.page is None:
+            self.browser = browser
+            self.context = await browser.new_context()
+            self.traffic = await watch_async(self.context, self.lightweight)
+            self.page = await self.context.new_page()
+            self.navigations = 0
+        elif self.traffic is not None:
+            self.traffic.report(self.page.url)
+
+        self.navigations += 1
+        return self.page
+
+    async def recycle(self):
+        if self.traffic is not None and self.page is not None:
+            self.traffic.report(self.page.url)
+        self.traffic = None
+        if self.context is not None:
+            try:
+                await self.context.close()
+            except Exception as e:
+                logging.warning("Failed to close browser context: %s", e)
+        self.context = None
+        self.page = None
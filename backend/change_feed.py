@@ -0,0 +1,183 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Iterator, Optional
+
+from pymongo import ASCENDING
+from pymongo.database import Collection
+from pymongo.errors import PyMongoError
+
+from schedule import AdaptiveSchedule
+
+
+class ChangeFeed:
+    """Follows documents inserted into a collection.
+
+    Uses a change stream when MongoDB runs as a replica set, and otherwise
+    polls for documents whose ``watermark_field`` is past the last one seen,
+    every ``poll_interval`` seconds or as ``schedule`` decides.
+    Progress is persisted in ``state_collection`` under ``name`` so a restart
+    resumes where it left off instead of rescanning history; without one,
+    progress lives only as long as the feed.
+
+    Watermarks are stamped by the writer before its insert commits, so a
+    slow insert can become visible after a later one has been read. Polling
+    therefore rereads the last ``lag`` before the watermark, and skips the
+    documents there it has already returned by ID. Watermarks must be ISO
+    timestamps for this.
+    """
+
+    collection: Collection
+    state_collection: Optional[Collection]
+    name: str
+    watermark_field: str
+    poll_interval: float
+    schedule: Optional[AdaptiveSchedule]
+    lag: timedelta
+    watermark: Optional[str]
+    # [_id, watermark] of every document returned within lag of the watermark
+    recent: list[list[Any]]
+    resume_token: Optional[dict]
+
+    def __init__(
+        self,
+        collection: Collection,
+        state_collection: Optional[Collection],
+        name: str,
+        watermark_field: str = "ingested_at",
+        poll_interval: float = 10,
+        schedule: Optional[AdaptiveSchedule] = None,
+        lag: timedelta = timedelta(minutes=5),
+    ):
+        self.collection = collection
+        self.state_collection = state_collection
+        self.name = name
+        self.watermark_field = watermark_field
+        self.poll_interval = poll_interval
+        self.schedule = schedule
+        self.lag = lag
+        self.collection.create_index([(watermark_field, ASCENDING)])
+
+        state = {}
+        if self.state_collection is not None:
+            state = self.state_collection.find_one({"_id": name}) or {}
+        self.watermark = state.get("watermark")
+        self.recent = state.get("recent")
+        self.resume_token = state.get("resume_token")
+        if self.watermark is None:
+            # Nothing persisted yet: history is the caller's backlog, not ours
+            self.watermark = self.latest_watermark()
+        if self.recent is None:
+            self.seed_recent()
+
+    def latest_watermark(self) -> Optional[str]:
+        latest = self.collection.find_one(
+            {self.watermark_field: {"$exists": True}},
+            sort=[(self.watermark_field, -1)],
+            projection={self.watermark_field: 1},
+        )
+        return latest[self.watermark_field] if latest else None
+
+    def since(self) -> Optional[str]:
+        """Where polling rereads from: ``lag`` before the watermark."""
+        if self.watermark is None:
+            return None
+        return (datetime.fromisoformat(self.watermark) - self.lag).isoformat()
+
+    def seed_recent(self):
+        """Treats every document within lag of the watermark as already returned.
+
+        Call after setting ``watermark`` by hand.
+        """
+        since = self.since()
+        self.recent = []
+        if since is None:
+            return
+        documents = self.collection.find(
+            {self.watermark_field: {"$gte": since, "$lte": self.watermark}},
+            projection={self.watermark_field: 1},
+        )
+        self.recent = [[d["_id"], d[self.watermark_field]] for d in documents]
+
+    def advance(self, document: dict, resume_token: Optional[dict] = None):
+        watermark = document.get(self.watermark_field)
+        if watermark is not None:
+            if self.watermark is None or watermark > self.watermark:
+                self.watermark = watermark
+            if not self.returned(document):
+                self.recent.append([document["_id"], watermark])
+            since = self.since()
+            self.recent = [[_id, w] for _id, w in self.recent if w >= since]
+        if resume_token is not None:
+            self.resume_token = resume_token
+
+        if self.state_collection is None:
+            return
+        self.state_collection.update_one(
+            {"_id": self.name},
+            {
+                "$set": {
+                    "watermark": self.watermark,
+                    "recent": self.recent,
+                    "resume_token": self.resume_token,
+                }
+            },
+            upsert=True,
+        )
+
+    def returned(self, document: dict) -> bool:
+        return any(_id == document["_id"] for _id, _ in self.recent)
+
+    def follow(self) -> Iterator[dict]:
+        try:
+            yield from self.follow_stream()
+        except PyMongoError as e:
+            # Standalone servers don't support change streams, and a stale
+            # resume token can't be resumed; the watermark covers both
+            logging.warning(
+                "Change stream unavailable for %s, polling instead: %s", self.name, e
+            )
+        yield from self.follow_polling()
+
+    def follow_stream(self) -> Iterator[dict]:
+        with self.collection.watch(
+            [{"$match": {"operationType": "insert"}}],
+            resume_after=self.resume_token,
+        ) as stream:
+            logging.info("Following %s with a change stream", self.name)
+            for change in stream:
+                document = change["fullDocument"]
+                if not self.returned(document):
+                    yield document
+                self.advance(document, change["_id"])
+
+    def read_new(self) -> list[dict]:
+        """Returns documents not yet returned, without advancing the watermark."""
+        query: dict = {self.watermark_field: {"$exists": True}}
+        since = self.since()
+        if since is not None:
+            query = {
+                self.watermark_field: {"$gte": since},
+                "_id": {"$nin": [_id for _id, _ in self.recent]},
+            }
+        return list(self.collection.find(query).sort(self.watermark_field, ASCENDING))
+
+    def follow_polling(self) -> Iterator[dict]:
+        logging.info("Following %s by polling", self.name)
+        while True:
+            try:
+                documents = self.read_new()
+            except PyMongoError as e:
+                logging.error("Failed to poll %s: %s", self.name, e)
+                documents = []
+
+            for document in documents:
+                yield document
+                self.advance(document)
+
+            if documents:
+                continue
+            if self.schedule is not None:
+                self.schedule.sleep()
+            else:
+                time.sleep(self.poll_interval)
@@ -0,0 +1,146 @@
+import argparse
+import logging
+import re
+import statistics
+import time
+import urllib.parse
+from pathlib import Path
+
+from playwright.sync_api import Page, sync_playwright
+
+from structs import EXTRACT_SCRIPT
+
+# Pages shaped like the feeds' sources: a WordPress post with a long comment
+# thread, a React news page with deeply nested markup, and a short brief.
+# Add real pages with --save
+FIXTURE_DIR = Path(__file__).parent / "extraction_fixtures"
+
+
+def per_locator_extract(page: Page) -> dict:
+    # The original extraction: one CDP round-trip per paragraph, plus one for the favicon
+    base = page.locator("p")
+
+    if page.get_by_role("article"):
+        article = page.get_by_role("article")
+        if article.get_by_role("paragraph"):
+            base = page.get_by_role("paragraph")
+
+    all_text = []
+    for match in base.all():
+        all_text.append(match.text_content())
+
+    favicon_url = page.evaluate(
+        """() => {
+        const link = document.querySelector('link[rel="icon"], link[rel="shortcut icon"]');
+        return link ? link.href : null;
+    }"""
+    )
+    return {"paragraphs": all_text, "favicon_url": favicon_url}
+
+
+def single_script_extract(page: Page) -> dict:
+    return page.evaluate(EXTRACT_SCRIPT)
+
+
+def synthetic_article(paragraphs: int) -> str:
+    body = "\n".join(
+        f"<p>Paragraph {i} of a long article about benchmarking extraction.</p>"
+        for i in range(paragraphs)
+    )
+    return f"""<html><head>
+<link rel="icon" href="/favicon.ico">
+<link rel="canonical" href="https://example.com/article">
+<meta name="author" content="Dolores">
+<meta property="og:title" content="Synthetic article">
+</head><body><nav><p>Menu</p></nav><article>{body}</article></body></html>"""
+
+
+def fixture_name(url: str) -> str:
+    hostname = urllib.parse.urlparse(url).hostname or "page"
+    return re.sub(r"[^\w.-]", "_", hostname) + ".html"
+
+
+def save_fixtures(urls: list[str]):
+    with sync_playwright() as p:
+        browser = p.chromium.launch()
+        page = browser.new_page()
+        try:
+            for url in urls:
+                page.goto(url, wait_until="load")
+                path = FIXTURE_DIR / fixture_name(url)
+                path.write_text(page.content())
+                logging.info("Saved %s to %s", url, path)
+        finally:
+            browser.close()
+
+
+def time_extraction(page: Page, extract, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract(page)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extraction Benchmark")
+    parser.add_argument(
+        "fixtures",
+        nargs="*",
+        type=Path,
+        help=f"Saved HTML pages. Defaults to every page in {FIXTURE_DIR.name}/.",
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="PARAGRAPHS",
+        help="Also time a generated article with this many paragraphs",
+    )
+    parser.add_argument(
+        "--save",
+        nargs="+",
+        metavar="URL",
+        help=f"Load these pages in Chromium and save them to {FIXTURE_DIR.name}/",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s | %(levelname)-7s | %(message)s")
+    logging.getLogger().setLevel(logging.INFO)
+
+    if args.save:
+        save_fixtures(args.save)
+        return
+
+    paths = args.fixtures or sorted(FIXTURE_DIR.glob("*.html"))
+    fixtures = {path.name: path.read_text() for path in paths}
+    if args.synthetic:
+        fixtures["synthetic"] = synthetic_article(args.synthetic)
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch()
+        page = browser.new_page()
+        try:
+            for name, html_text in fixtures.items():
+                page.set_content(html_text)
+                paragraphs = len(single_script_extract(page)["paragraphs"])
+                for label, extract in [
+                    ("per-locator", per_locator_extract),
+                    ("single-script", single_script_extract),
+                ]:
+                    timings = time_extraction(page, extract, args.repeat)
+                    logging.info(
+                        "%s (%d paragraphs) %-13s median %.1f ms, min %.1f ms",
+                        name,
+                        paragraphs,
+                        label,
+                        statistics.median(timings) * 1000,
+                        min(timings) * 1000,
+                    )
+        finally:
+            browser.close()
+
+
+if __name__ == "__main__":
+    main()
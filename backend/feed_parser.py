@@ -0,0 +1,84 @@
+import dataclasses
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from typing import IO, Iterator, Optional
+
+from dateutil.parser import parse as parse_date
+
+ENTRY_TAGS = {"entry", "item"}
+
+
+def local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+@dataclasses.dataclass
+class FeedEntry:
+    """One RSS <item> or Atom <entry>, whichever format the feed uses."""
+
+    id: Optional[str]
+    title: str
+    link: str
+    published: Optional[str]
+    content: str
+    links: dict[str, str]
+
+    def published_at(self) -> Optional[datetime]:
+        if not self.published:
+            return None
+        date = parse_date(self.published)
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        return date
+
+    @staticmethod
+    def from_element(element: ElementTree.Element):
+        fields: dict[str, str] = {}
+        links: dict[str, str] = {}
+        for child in element:
+            name = local_name(child.tag)
+            if name == "link" and "href" in child.attrib:
+                # Atom: <link rel="..." href="..."/>, rel defaults to alternate
+                links.setdefault(child.attrib.get("rel", "alternate"), child.attrib["href"])
+            else:
+                fields.setdefault(name, (child.text or "").strip())
+
+        link = links.get("alternate") or fields.get("link", "")
+        return FeedEntry(
+            id=fields.get("id") or fields.get("guid"),
+            title=fields.get("title", ""),
+            link=link,
+            published=fields.get("published")
+            or fields.get("pubDate")
+            or fields.get("date")
+            or fields.get("updated"),
+            # <content:encoded> is the full RSS body, <description> the summary
+            content=fields.get("content")
+            or fields.get("encoded")
+            or fields.get("description")
+            or fields.get("summary", ""),
+            links=links,
+        )
+
+
+def parse_feed(stream: IO[bytes]) -> Iterator[FeedEntry]:
+    """Yields a feed's entries as they are read, without building the whole document.
+
+    Each entry's element is freed once it has been yielded, so memory stays
+    flat however long the feed is, and a caller that stops early stops
+    reading the stream.
+    """
+    open_elements: list[ElementTree.Element] = []
+    for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            open_elements.append(element)
+            continue
+
+        open_elements.pop()
+        if local_name(element.tag) not in ENTRY_TAGS:
+            continue
+
+        yield FeedEntry.from_element(element)
+        # Detach the entry from <feed> or <channel> so nothing keeps it alive
+        if open_elements:
+            open_elements[-1].remove(element)
@@ -0,0 +1,148 @@
+import dataclasses
+import heapq
+import itertools
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import List
+
+from pymongo.database import Collection
+from pymongo.errors import BulkWriteError
+
+from feed_fetcher import FeedFetcher
+from rss_providers import FeedConfig, read_feed
+from schedule import AdaptiveSchedule
+from urls import SeenUrls
+
+
+@dataclasses.dataclass
+class FeedState:
+    feed: FeedConfig
+    # Articles published before this were read on an earlier poll
+    after: datetime
+    schedule: AdaptiveSchedule
+    failures: int = 0
+
+
+class FeedScheduler:
+    """Polls every feed from one thread, fetching on a bounded worker pool.
+
+    Each feed has its own AdaptiveSchedule, learned from the publish dates
+    of its source's articles, so busy feeds are polled often and quiet ones
+    rarely.
+    """
+
+    collection: Collection
+    seen: SeenUrls
+    fetcher: FeedFetcher
+    workers: int
+
+    def __init__(
+        self,
+        feeds: List[FeedConfig],
+        collection: Collection,
+        schedule_collection: Collection,
+        seen: SeenUrls,
+        fetcher: FeedFetcher,
+        after: datetime,
+        workers: int = 8,
+        min_interval: float = 2 * 60,
+        max_interval: float = 60 * 60,
+    ):
+        self.collection = collection
+        self.seen = seen
+        self.fetcher = fetcher
+        self.workers = workers
+
+        self.order = itertools.count()
+        self.queue: list[tuple[float, int, FeedState]] = []
+        # Spread the first round over a minute instead of fetching every feed at once
+        start = time.monotonic()
+        for feed in feeds:
+            schedule = AdaptiveSchedule(
+                collection,
+                schedule_collection,
+                f"rss:{feed.source}",
+                min_interval,
+                max_interval,
+                query={"source": feed.source},
+                field="date",
+            )
+            state = FeedState(feed, after, schedule)
+            self.schedule(state, start + random.uniform(0, 60))
+
+    def schedule(self, state: FeedState, due: float):
+        heapq.heappush(self.queue, (due, next(self.order), state))
+
+    def poll(self, state: FeedState) -> int:
+        """Reads the feed and inserts articles that are new. Returns how many there were."""
+        started = datetime.now(timezone.utc)
+        all_metadata = read_feed(state.feed, self.fetcher, state.after)
+
+        # Filter out old and recently seen articles, and convert to JSON dicts
+        new_metadata = {}
+        for a in all_metadata:
+            if a.published_after(state.after) and a._id not in self.seen:
+                new_metadata[a._id] = dataclasses.asdict(a)
+
+        try:
+            if new_metadata:
+                self.collection.insert_many(list(new_metadata.values()), ordered=False)
+        except BulkWriteError as bwe:
+            for error in bwe.details["writeErrors"]:
+                if error["code"] != 11000:
+                    raise
+                logging.warning("Duplicate article from %s", state.feed.source)
+                new_metadata.pop(error["op"]["_id"], None)
+                self.seen.add(error["op"]["_id"])
+
+        for url in new_metadata:
+            self.seen.add(url)
+        # Only now is it safe for the next poll to get a 304
+        self.fetcher.commit(state.feed.url)
+        state.after = started
+        return len(new_metadata)
+
+    def finish(self, state: FeedState, future: Future):
+        try:
+            new = future.result()
+            state.failures = 0
+            logging.info("%s: %d new articles", state.feed.source, new)
+        except Exception as e:
+            # Back off a failing feed, but keep retrying it
+            state.failures += 1
+            logging.error("Failed to fetch %s: %s", state.feed.source, e)
+
+        interval = state.schedule.next_interval(state.failures)
+        logging.info(
+            "%s: next poll in %d minutes", state.feed.source, interval // 60
+        )
+        self.schedule(state, time.monotonic() + interval)
+
+    def run(self):
+        in_flight: dict[Future, FeedState] = {}
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="feed") as executor:
+            while True:
+                now = time.monotonic()
+                # Only hand out as many feeds as there are workers, so none waits in the executor
+                while (
+                    self.queue
+                    and self.queue[0][0] <= now
+                    and len(in_flight) < self.workers
+                ):
+                    _, _, state = heapq.heappop(self.queue)
+                    in_flight[executor.submit(self.poll, state)] = state
+
+                timeout = None
+                if self.queue and len(in_flight) < self.workers:
+                    timeout = max(0.0, self.queue[0][0] - now)
+
+                if not in_flight:
+                    time.sleep(timeout if timeout is not None else 60)
+                    continue
+
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finish(in_flight.pop(future), future)
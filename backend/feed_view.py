@@ -0,0 +1,76 @@
+import logging
+from typing import Optional
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.database import Collection
+
+
+class FeedView:
+    """A denormalized copy of every analyzed article, for the API to read.
+
+    Each document is an article's metadata, content and analysis merged
+    into one. Documents are written when their analysis is inserted, so
+    reads never join the three collections.
+    """
+
+    feed_collection: Collection
+    metadata_collection: Collection
+
+    def __init__(self, feed_collection: Collection, metadata_collection: Collection):
+        self.feed_collection = feed_collection
+        self.metadata_collection = metadata_collection
+        self.feed_collection.create_index([("date", DESCENDING), ("_id", DESCENDING)])
+        self.feed_collection.create_index(
+            [("source", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]
+        )
+        self.feed_collection.create_index([("duplicate_of", ASCENDING)])
+        # The API's cache version is the latest analysis
+        self.feed_collection.create_index([("analyzed_at", DESCENDING)])
+
+    def pipeline(self, match: Optional[dict] = None) -> list[dict]:
+        return [
+            *([{"$match": match}] if match else []),
+            {
+                "$lookup": {
+                    "from": "page_content",
+                    "localField": "_id",
+                    "foreignField": "_id",
+                    "pipeline": [{"$project": {"minhash": 0, "lsh_bands": 0}}],
+                    "as": "content",
+                }
+            },
+            {"$unwind": "$content"},
+            {
+                "$lookup": {
+                    "from": "page_analysis",
+                    "localField": "_id",
+                    "foreignField": "_id",
+                    "as": "analysis",
+                }
+            },
+            {"$unwind": "$analysis"},
+            {
+                "$replaceRoot": {
+                    "newRoot": {"$mergeObjects": ["$$ROOT", "$content", "$analysis"]}
+                }
+            },
+            {"$project": {"content": 0, "analysis": 0}},
+            {
+                "$merge": {
+                    "into": self.feed_collection.name,
+                    "on": "_id",
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert",
+                }
+            },
+        ]
+
+    def add(self, article_id: str):
+        self.metadata_collection.aggregate(self.pipeline({"_id": article_id}))
+
+    def rebuild(self):
+        logging.info("Rebuilding the feed from every analyzed article...")
+        self.metadata_collection.aggregate(self.pipeline())
+        logging.info(
+            "Feed has %d articles", self.feed_collection.estimated_document_count()
+        )
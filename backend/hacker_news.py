@@ -3,23 +3,87 @@ import argparse
 import logging
 import urllib.parse
 import bs4
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from pymongo.database import Collection
 from structs import PageMetadata
-from datetime import datetime
-import random
-import time
+from urls import SeenUrls, canonicalize_url
+from schedule import AdaptiveSchedule
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from requests.adapters import HTTPAdapter
 import dataclasses
 from enum import Enum
 
 
-def get_top_story_ids():
-    response = requests.get("https://hacker-news.firebaseio.com/v0/topstories.json")
-    ids = response.json()
-    assert isinstance(ids, list)
-    ids = [int(id) for id in ids][:50]
-    logging.info("Got %d stories", len(ids))
-    return ids
+HN_API = "https://hacker-news.firebaseio.com/v0"
+STORY_LISTS = ["top", "new", "best"]
+
+
+class HackerNewsClient:
+    """Fetches HN lists and items over one pooled session.
+
+    Item IDs that have been processed are kept in ``seen_collection``, so
+    neither the next cycle nor a restart fetches and classifies them again.
+    """
+
+    seen_collection: Collection
+    session: requests.Session
+    workers: int
+
+    def __init__(
+        self,
+        seen_collection: Collection,
+        workers: int = 16,
+        seen_ttl: timedelta = timedelta(days=7),
+    ):
+        self.seen_collection = seen_collection
+        self.workers = workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        # MongoDB deletes entries once they are older than the TTL
+        self.seen_collection.create_index(
+            "seen_at", expireAfterSeconds=int(seen_ttl.total_seconds())
+        )
+
+    def story_ids(self, lists: list[str], limit: Optional[int] = None) -> list[int]:
+        """IDs from each list, in list order, without repeats."""
+        ids: dict[int, None] = {}
+        for name in lists:
+            response = self.session.get(f"{HN_API}/{name}stories.json", timeout=30)
+            response.raise_for_status()
+            list_ids = response.json()
+            assert isinstance(list_ids, list)
+            ids.update((int(id), None) for id in list_ids[:limit])
+        logging.info("Got %d stories from %s", len(ids), ", ".join(lists))
+        return list(ids)
+
+    def unseen(self, ids: list[int]) -> list[int]:
+        seen = {
+            document["_id"]
+            for document in self.seen_collection.find(
+                {"_id": {"$in": ids}}, projection={"_id": 1}
+            )
+        }
+        return [id for id in ids if id not in seen]
+
+    def mark_seen(self, ids: list[int]):
+        if not ids:
+            return
+        now = datetime.now(timezone.utc)
+        self.seen_collection.bulk_write(
+            [
+                UpdateOne({"_id": id}, {"$set": {"seen_at": now}}, upsert=True)
+                for id in ids
+            ],
+            ordered=False,
+        )
+
+    def item(self, id: int) -> Optional[dict]:
+        response = self.session.get(f"{HN_API}/item/{id}.json", timeout=30)
+        response.raise_for_status()
+        return response.json()
 
 
 class HNType(Enum):
@@ -28,7 +92,8 @@ class HNType(Enum):
     Unknown = 2
 
 
-def classify(title: str, url_str: str) -> HNType:
+def classify_url(title: str, url_str: str) -> Optional[HNType]:
+    """Classifies from the title and URL alone, or returns None if the page is needed."""
     url = urllib.parse.urlparse(url_str)
 
     assert url.hostname
@@ -72,78 +137,250 @@ def classify(title: str, url_str: str) -> HNType:
     if "/post/" in url.path:
         return HNType.Blog
 
-    # If there is an "Author" tag on this page
-    # it's most likely a blog
-    try:
-        html_page = get_html_page(url_str)
-    except:
-        return HNType.Unknown
+    return None
 
-    author = html_page.find("meta", {"name": "author"})
 
+def classify_head(head: bs4.BeautifulSoup) -> HNType:
+    # If there is an "Author" tag on this page
+    # it's most likely a blog
+    author = head.find("meta", {"name": "author"})
     if isinstance(author, bs4.Tag):
         return HNType.Blog
 
-    article_content = html_page.find("meta", {"content": "article"})
+    article_content = head.find("meta", {"content": "article"})
     if isinstance(article_content, bs4.Tag):
         return HNType.Blog
 
     return HNType.Unknown
 
 
-def get_html_page(url: str):
-    response = requests.get(url)
-    html_page = bs4.BeautifulSoup(response.content, features="html.parser")
-    return html_page
+class Classifier:
+    """Classifies HN links, downloading as little of each page as it can.
+
+    Only the page's <head> is read to decide. The rest is downloaded only
+    for blogs, and is saved in ``html_collection`` so the page parser
+    doesn't fetch it again. Verdicts are cached per URL in
+    ``verdict_collection`` for ``ttl``. Every probed page is also counted
+    for its domain, and a domain whose first ``domain_min_pages`` or more
+    pages were all blogs is taken to serve only blogs, so mixed domains
+    keep being probed page by page.
+    """
+
+    verdict_collection: Collection
+    html_collection: Collection
+    session: requests.Session
+    max_head_bytes: int
+    max_page_bytes: int
+    domain_min_pages: int
+
+    def __init__(
+        self,
+        verdict_collection: Collection,
+        html_collection: Collection,
+        pool_size: int = 16,
+        ttl: timedelta = timedelta(days=7),
+        html_ttl: timedelta = timedelta(days=1),
+        max_head_bytes: int = 64 * 1024,
+        max_page_bytes: int = 5 * 1024 * 1024,
+        domain_min_pages: int = 3,
+    ):
+        self.verdict_collection = verdict_collection
+        self.html_collection = html_collection
+        self.max_head_bytes = max_head_bytes
+        self.max_page_bytes = max_page_bytes
+        self.domain_min_pages = domain_min_pages
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "Dolores/1.0"
+        self.verdict_collection.create_index(
+            "checked_at", expireAfterSeconds=int(ttl.total_seconds())
+        )
+        self.html_collection.create_index(
+            "fetched_at", expireAfterSeconds=int(html_ttl.total_seconds())
+        )
+
+    def cached(self, key: str) -> Optional[HNType]:
+        verdict = self.verdict_collection.find_one({"_id": key})
+        return HNType[verdict["verdict"]] if verdict else None
 
+    def remember(self, key: str, verdict: HNType):
+        self.verdict_collection.replace_one(
+            {"_id": key},
+            {"verdict": verdict.name, "checked_at": datetime.now(timezone.utc)},
+            upsert=True,
+        )
 
-def hn_loop(collection: Collection, global_ids: set[int]):
-    while True:
-        ids = get_top_story_ids()
-        new_ids = list(filter(lambda id: id not in global_ids, ids))
-        global_ids.update(new_ids)
+    def domain_verdict(self, domain_key: str) -> Optional[HNType]:
+        pages = self.verdict_collection.find_one({"_id": domain_key})
+        if (
+            pages
+            and pages.get("pages", 0) >= self.domain_min_pages
+            and pages.get("blogs") == pages["pages"]
+        ):
+            return HNType.Blog
+        return None
+
+    def count_page(self, domain_key: str, verdict: HNType):
+        self.verdict_collection.update_one(
+            {"_id": domain_key},
+            {
+                "$inc": {"pages": 1, "blogs": int(verdict == HNType.Blog)},
+                # Counted afresh once the TTL expires the document
+                "$setOnInsert": {"checked_at": datetime.now(timezone.utc)},
+            },
+            upsert=True,
+        )
 
-        for id in new_ids:
-            response = requests.get(
-                f"https://hacker-news.firebaseio.com/v0/item/{id}.json"
-            )
-            metadata = response.json()
-            if metadata["type"] != "story":
-                continue
-
-            if "url" not in metadata:
-                continue
-
-            title = metadata["title"]
-            url = metadata["url"]
-            date = datetime.fromtimestamp(metadata["time"]).isoformat()
-            discussion_url = f"https://news.ycombinator.com/item?id={id}"
-
-            page_type = classify(title, url)
-
-            if page_type == HNType.Blog:
-                metadata = PageMetadata.from_raw(
-                    url, "Hacker News", title, date, discussion_url
-                )
-                try:
-                    collection.insert_one(dataclasses.asdict(metadata))
-                    logging.info("✅ Inserted: %s", title)
-                except:
-                    logging.error("❗️ Could not insert: %s", title)
-            else:
-                logging.info("❌ %s: %s", page_type, title)
-
-        # Sleep for 2 to 5 minutes
-        duration = random.randint(60 * 2, 60 * 5)
-        logging.info(
-            "Sleeping for %d minutes, %d seconds...", duration // 60, duration % 60
+    def classify(self, title: str, url: str) -> HNType:
+        verdict = classify_url(title, url)
+        if verdict is not None:
+            return verdict
+
+        url_key = f"url:{canonicalize_url(url)}"
+        domain_key = f"domain:{urllib.parse.urlparse(url).hostname}"
+        verdict = self.cached(url_key) or self.domain_verdict(domain_key)
+        if verdict is not None:
+            return verdict
+
+        try:
+            verdict = self.probe(url)
+        except Exception as e:
+            logging.warning("Could not probe %s: %s", url, e)
+            return HNType.Unknown
+
+        self.remember(url_key, verdict)
+        self.count_page(domain_key, verdict)
+        return verdict
+
+    def probe(self, url: str) -> HNType:
+        with self.session.get(url, timeout=15, stream=True) as response:
+            response.raise_for_status()
+            chunks = response.iter_content(chunk_size=8192)
+
+            # Stop reading at </head>; everything the verdict needs is above it
+            content = b""
+            for chunk in chunks:
+                content += chunk
+                # Only the new bytes, and a tag split across chunks, can hold it
+                tail = content[-(len(chunk) + len(b"</head>")) :].lower()
+                if b"</head>" in tail or len(content) > self.max_head_bytes:
+                    break
+
+            head = bs4.BeautifulSoup(content, features="html.parser")
+            verdict = classify_head(head)
+            if verdict != HNType.Blog:
+                return verdict
+
+            # It will be parsed next, so download the rest now rather than twice
+            for chunk in chunks:
+                content += chunk
+                if len(content) > self.max_page_bytes:
+                    return verdict
+
+        self.html_collection.replace_one(
+            {"_id": canonicalize_url(url)},
+            {
+                "html": bs4.UnicodeDammit(content, is_html=True).unicode_markup,
+                "fetched_at": datetime.now(timezone.utc),
+            },
+            upsert=True,
         )
-        time.sleep(duration)
+        return verdict
+
+
+def ingest_item(
+    collection: Collection,
+    client: HackerNewsClient,
+    classifier: Classifier,
+    seen: SeenUrls,
+    id: int,
+):
+    item = client.item(id)
+    if not item or item.get("type") != "story" or "url" not in item:
+        return
+
+    title = item["title"]
+    url = item["url"]
+    date = datetime.fromtimestamp(item["time"]).isoformat()
+    discussion_url = f"https://news.ycombinator.com/item?id={id}"
+
+    # Skip before classify, which may download the whole page
+    if canonicalize_url(url) in seen:
+        logging.info("🔁 Already seen: %s", title)
+        return
+
+    page_type = classifier.classify(title, url)
+
+    if page_type == HNType.Blog:
+        metadata = PageMetadata.from_raw(url, "Hacker News", title, date, discussion_url)
+        try:
+            collection.insert_one(dataclasses.asdict(metadata))
+            logging.info("✅ Inserted: %s", title)
+        except:
+            logging.error("❗️ Could not insert: %s", title)
+        seen.add(metadata._id)
+    else:
+        logging.info("❌ %s: %s", page_type, title)
+
+
+def hn_loop(
+    collection: Collection,
+    client: HackerNewsClient,
+    classifier: Classifier,
+    seen: SeenUrls,
+    schedule: AdaptiveSchedule,
+    lists: list[str],
+    limit: Optional[int],
+):
+    with ThreadPoolExecutor(client.workers, thread_name_prefix="hn") as executor:
+        while True:
+            failures = 0
+            try:
+                new_ids = client.unseen(client.story_ids(lists, limit))
+                logging.info("%d stories are new", len(new_ids))
+
+                # Fetching and classifying are both network-bound, so items go in parallel
+                futures = {
+                    executor.submit(
+                        ingest_item, collection, client, classifier, seen, id
+                    ): id
+                    for id in new_ids
+                }
+                done = []
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                        done.append(futures[future])
+                    except Exception as e:
+                        # Left unseen so the next cycle tries again
+                        logging.error("Failed to ingest item %d: %s", futures[future], e)
+                client.mark_seen(done)
+            except Exception as e:
+                failures = 1
+                logging.error("Failed to read Hacker News: %s", e)
+
+            schedule.sleep(failures)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Hacker News Observer")
-    parser.parse_args()
+    parser.add_argument(
+        "--lists",
+        nargs="+",
+        choices=STORY_LISTS,
+        default=["top"],
+        help="Which story lists to follow",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=100,
+        help="Stories to read from the top of each list",
+    )
+    parser.add_argument("--workers", type=int, default=16, help="Items fetched at once")
+    args = parser.parse_args()
 
     logging.basicConfig(format="%(asctime)s | %(levelname)-7s | %(message)s")
     logging.getLogger().setLevel(logging.INFO)
@@ -153,8 +390,20 @@ def main():
     db = client.dolores
     collection = db.page_metadata
 
-    global_ids: set[int] = set()
-    hn_loop(collection, global_ids)
+    hn = HackerNewsClient(db.hn_seen, args.workers)
+    classifier = Classifier(db.hn_verdicts, db.page_html, args.workers)
+    seen = SeenUrls()
+    seen.warm(collection)
+    schedule = AdaptiveSchedule(
+        collection,
+        db.schedule,
+        "hacker_news",
+        min_interval=60 * 2,
+        max_interval=60 * 15,
+        query={"source": "Hacker News"},
+        field="date",
+    )
+    hn_loop(collection, hn, classifier, seen, schedule, args.lists, args.limit)
 
 
 if __name__ == "__main__":
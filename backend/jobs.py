@@ -0,0 +1,208 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Optional
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.database import Collection
+
+
+class JobState(str, Enum):
+    Pending = "pending"
+    Leased = "leased"
+    Done = "done"
+    Failed = "failed"
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+
+class JobQueue:
+    """Work items of one ``kind`` that any number of workers, on any machine, can share.
+
+    A worker leases a job before processing it. The lease expires if the
+    worker dies, and the job becomes available again. Failures are retried
+    with exponential backoff until ``max_attempts``. After that the job stays
+    failed, so a broken URL isn't retried every cycle forever.
+    """
+
+    collection: Collection
+    kind: str
+    lease_duration: timedelta
+    max_attempts: int
+    backoff: timedelta
+
+    def __init__(
+        self,
+        collection: Collection,
+        kind: str,
+        lease_duration: timedelta = timedelta(minutes=10),
+        max_attempts: int = 5,
+        backoff: timedelta = timedelta(minutes=2),
+    ):
+        self.collection = collection
+        self.kind = kind
+        self.lease_duration = lease_duration
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.available = threading.Event()
+        self.collection.create_index(
+            [("kind", ASCENDING), ("state", ASCENDING), ("available_at", ASCENDING)]
+        )
+        self.collection.create_index(
+            [("kind", ASCENDING), ("state", ASCENDING), ("lease_expires", ASCENDING)]
+        )
+
+    def job_id(self, item_id: str) -> str:
+        return f"{self.kind}:{item_id}"
+
+    def enqueue(self, item_ids: list[str]):
+        """Adds jobs for items that don't have one yet. Existing jobs are left alone."""
+        # Pending items are found again every cycle, including ones whose job
+        # failed for good; skip the writes for every item that has a job
+        existing = {
+            job["item_id"]
+            for job in self.collection.find(
+                {"_id": {"$in": [self.job_id(item_id) for item_id in item_ids]}},
+                projection={"item_id": 1},
+            )
+        }
+        item_ids = [item_id for item_id in item_ids if item_id not in existing]
+        if not item_ids:
+            return
+        now = datetime.now(timezone.utc)
+        self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": self.job_id(item_id)},
+                    {
+                        "$setOnInsert": {
+                            "kind": self.kind,
+                            "item_id": item_id,
+                            "state": JobState.Pending.value,
+                            "attempts": 0,
+                            "available_at": now,
+                            "created_at": now,
+                        }
+                    },
+                    upsert=True,
+                )
+                for item_id in item_ids
+            ],
+            ordered=False,
+        )
+        self.available.set()
+
+    def lease(self, worker: str) -> Optional[str]:
+        """Leases the next available job and returns its item ID, if there is one."""
+        while True:
+            now = datetime.now(timezone.utc)
+            job = self.collection.find_one_and_update(
+                {
+                    "kind": self.kind,
+                    "$or": [
+                        {
+                            "state": JobState.Pending.value,
+                            "available_at": {"$lte": now},
+                        },
+                        # The worker holding this lease died or hung
+                        {
+                            "state": JobState.Leased.value,
+                            "lease_expires": {"$lte": now},
+                        },
+                    ],
+                },
+                {
+                    "$set": {
+                        "state": JobState.Leased.value,
+                        "worker": worker,
+                        "lease_expires": now + self.lease_duration,
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("available_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if not job:
+                return None
+            if job["attempts"] <= self.max_attempts:
+                return job["item_id"]
+            self.fail(job["item_id"], worker, "lease expired too many times")
+
+    def wait(self, timeout: float):
+        """Blocks until this process enqueues work, or ``timeout`` seconds pass.
+
+        Other processes enqueue too, so callers must still poll.
+        """
+        self.available.wait(timeout)
+        self.available.clear()
+
+    def complete(self, item_id: str, worker: str):
+        self.collection.update_one(
+            {"_id": self.job_id(item_id), "worker": worker},
+            {
+                "$set": {
+                    "state": JobState.Done.value,
+                    "finished_at": datetime.now(timezone.utc),
+                },
+                "$unset": {"lease_expires": ""},
+            },
+        )
+
+    def state(self, item_id: str) -> Optional[JobState]:
+        job = self.collection.find_one({"_id": self.job_id(item_id)}, {"state": 1})
+        return JobState(job["state"]) if job else None
+
+    def defer(self, item_id: str, worker: str, delay: timedelta, reason: str):
+        """Puts a job back that can't run yet, without counting the attempt."""
+        now = datetime.now(timezone.utc)
+        logging.info("Deferring %s for %s: %s", item_id, delay, reason)
+        self.collection.update_one(
+            {"_id": self.job_id(item_id), "worker": worker},
+            {
+                "$set": {
+                    "state": JobState.Pending.value,
+                    "available_at": now + delay,
+                    "error": reason,
+                },
+                "$inc": {"attempts": -1},
+                # When the job first started waiting, kept across deferrals
+                "$min": {"deferred_since": now},
+                "$unset": {"lease_expires": ""},
+            },
+        )
+
+    def deferred_longer_than(self, item_id: str, duration: timedelta) -> bool:
+        cutoff = datetime.now(timezone.utc) - duration
+        return (
+            self.collection.count_documents(
+                {"_id": self.job_id(item_id), "deferred_since": {"$lte": cutoff}},
+                limit=1,
+            )
+            > 0
+        )
+
+    def fail(self, item_id: str, worker: str, error: str):
+        job = self.collection.find_one({"_id": self.job_id(item_id), "worker": worker})
+        if not job:
+            return
+
+        now = datetime.now(timezone.utc)
+        if job["attempts"] >= self.max_attempts:
+            logging.error(
+                "Giving up on %s after %d attempts: %s", item_id, job["attempts"], error
+            )
+            update = {"state": JobState.Failed.value, "finished_at": now}
+        else:
+            delay = self.backoff * 2 ** (job["attempts"] - 1)
+            logging.warning("Retrying %s in %s: %s", item_id, delay, error)
+            update = {"state": JobState.Pending.value, "available_at": now + delay}
+
+        self.collection.update_one(
+            {"_id": job["_id"], "worker": worker},
+            {"$set": {**update, "error": error}, "$unset": {"lease_expires": ""}},
+        )
@@ -0,0 +1,153 @@
+import dataclasses
+import logging
+import threading
+from typing import Protocol
+
+import lmstudio as lms
+import requests
+from pydantic import BaseModel
+
+
+@dataclasses.dataclass
+class ModelResponse:
+    content: str
+    prompt_tokens: int
+    predicted_tokens: int
+
+
+class Model(Protocol):
+    id: str
+
+    def respond(
+        self, system_prompt: str, prompt: str, response_format: type[BaseModel]
+    ) -> ModelResponse: ...
+
+
+class LmStudioModel:
+    """The model loaded in LM Studio.
+
+    The analyzer calls it from several threads, and the SDK doesn't promise
+    that its sync client can be shared between them, so each thread opens
+    its own client.
+    """
+
+    id: str
+
+    def __init__(self):
+        self.local = threading.local()
+        self.id = self.model().identifier
+
+    def model(self) -> lms.LLM:
+        if not hasattr(self.local, "model"):
+            self.local.model = lms.Client().llm.model()
+        return self.local.model
+
+    def respond(
+        self, system_prompt: str, prompt: str, response_format: type[BaseModel]
+    ) -> ModelResponse:
+        chat = lms.Chat(initial_prompt=system_prompt)
+        chat.add_user_message(prompt)
+        response = self.model().respond(chat, response_format=response_format)
+        return ModelResponse(
+            response.content,
+            response.stats.prompt_tokens_count or 0,
+            response.stats.predicted_tokens_count or 0,
+        )
+
+
+class OpenAiModel:
+    """Any OpenAI-compatible chat completions server, e.g. a local llama.cpp or vLLM."""
+
+    id: str
+    base_url: str
+
+    def __init__(self, base_url: str, model_id: str, timeout: float = 300):
+        self.id = model_id
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        # Sessions aren't thread-safe, so each analyzer thread has its own
+        self.local = threading.local()
+
+    def session(self) -> requests.Session:
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def respond(
+        self, system_prompt: str, prompt: str, response_format: type[BaseModel]
+    ) -> ModelResponse:
+        response = self.session().post(
+            f"{self.base_url}/chat/completions",
+            json={
+                "model": self.id,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt},
+                ],
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": response_format.__name__,
+                        "schema": response_format.model_json_schema(),
+                    },
+                },
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        body = response.json()
+        usage = body.get("usage", {})
+        return ModelResponse(
+            body["choices"][0]["message"]["content"],
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+        )
+
+
+@dataclasses.dataclass
+class AnalysisStats:
+    articles: int = 0
+    requests: int = 0
+    failures: int = 0
+    prompt_tokens: int = 0
+    predicted_tokens: int = 0
+    total_latency: float = 0.0
+    # Wall time spent working, excluding the sleeps between cycles
+    busy: float = 0.0
+    lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def record(self, response: ModelResponse, latency: float):
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += response.prompt_tokens
+            self.predicted_tokens += response.predicted_tokens
+            self.total_latency += latency
+
+    def record_article(self):
+        with self.lock:
+            self.articles += 1
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def record_cycle(self, duration: float):
+        with self.lock:
+            self.busy += duration
+
+    def log(self, logger: logging.Logger):
+        if self.busy <= 0:
+            return
+        logger.info(
+            "Analysis: %d articles (%.1f/busy min), %d requests, %d failed, "
+            "%.1f tokens/busy s, %d prompt tokens, latency avg %.1fs",
+            self.articles,
+            self.articles / self.busy * 60,
+            self.requests,
+            self.failures,
+            self.predicted_tokens / self.busy,
+            self.prompt_tokens,
+            self.total_latency / self.requests if self.requests else 0.0,
+        )
@@ -0,0 +1,147 @@
+import dataclasses
+import logging
+import urllib.parse
+from collections import Counter
+from typing import Optional
+
+from playwright.async_api import BrowserContext as AsyncBrowserContext
+from playwright.async_api import Page as AsyncPage
+from playwright.async_api import Request as AsyncRequest
+from playwright.async_api import Response as AsyncResponse
+from playwright.async_api import Route as AsyncRoute
+from playwright.sync_api import BrowserContext, Page, Request, Response, Route
+
+# Article text never depends on these, and they make up most of a page's weight
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+
+
+# Suffixes under which sites register a third label, e.g. bbc.co.uk. Not the
+# whole public suffix list, but the ones news sites actually use
+# fmt: off
+MULTI_PART_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "ltd.uk", "me.uk", "net.uk",
+    "com.au", "net.au", "org.au", "edu.au", "gov.au",
+    "co.nz", "org.nz", "net.nz", "govt.nz",
+    "co.jp", "ne.jp", "or.jp", "ac.jp",
+    "co.kr", "or.kr",
+    "co.in", "net.in", "org.in",
+    "co.za", "org.za",
+    "com.br", "com.cn", "com.hk", "com.mx", "com.sg", "com.tr", "com.tw",
+    "co.il", "org.il",
+}
+# fmt: on
+
+
+def site_of(url: str) -> str:
+    """The registrable domain of ``url``, for telling first and third parties apart."""
+    labels = (urllib.parse.urlparse(url).hostname or "").split(".")
+    if ".".join(labels[-2:]) in MULTI_PART_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def page_url_of(request: Request | AsyncRequest) -> Optional[str]:
+    try:
+        return request.frame.page.url
+    except Exception:
+        # Service worker requests have no frame
+        return None
+
+
+@dataclasses.dataclass
+class PageTraffic:
+    """What a pooled page loaded and had blocked since it was last reported.
+
+    Lives as long as the browser context, so lazy images, late scripts and
+    fonts stay blocked after goto returns, through extraction and while the
+    page sits idle in the pool.
+    """
+
+    lightweight: bool
+    requests: int = 0
+    bytes_loaded: int = 0
+    blocked: Counter = dataclasses.field(default_factory=Counter)
+
+    def should_block(self, request: Request | AsyncRequest) -> Optional[str]:
+        if not self.lightweight:
+            return None
+        if request.resource_type in BLOCKED_RESOURCE_TYPES:
+            return request.resource_type
+        if request.resource_type == "script":
+            page_url = page_url_of(request)
+            if page_url and site_of(request.url) != site_of(page_url):
+                return "third-party script"
+        return None
+
+    def record_response(self, response: Response | AsyncResponse):
+        # Chunked responses have no length, so this undercounts rather than guesses
+        self.requests += 1
+        length = response.headers.get("content-length")
+        if length and length.isdigit():
+            self.bytes_loaded += int(length)
+
+    def report(self, url: str):
+        """Logs the traffic since the last report, attributed to ``url``, and starts over."""
+        if self.requests or self.blocked:
+            logging.info(
+                "Loaded %s: %d requests, %d KB, blocked %d requests %s",
+                url,
+                self.requests,
+                self.bytes_loaded // 1024,
+                sum(self.blocked.values()),
+                dict(self.blocked),
+            )
+        self.requests = 0
+        self.bytes_loaded = 0
+        self.blocked = Counter()
+
+
+def watch(context: BrowserContext, lightweight: bool) -> PageTraffic:
+    """Counts, and in lightweight mode blocks, traffic for every page of ``context``.
+
+    Routes and listeners go away with the context, so nothing is removed here.
+    """
+    traffic = PageTraffic(lightweight)
+
+    def handle_route(route: Route):
+        reason = traffic.should_block(route.request)
+        if reason:
+            traffic.blocked[reason] += 1
+            route.abort()
+        else:
+            route.continue_()
+
+    context.on("response", traffic.record_response)
+    if lightweight:
+        context.route("**/*", handle_route)
+    return traffic
+
+
+async def watch_async(context: AsyncBrowserContext, lightweight: bool) -> PageTraffic:
+    traffic = PageTraffic(lightweight)
+
+    async def handle_route(route: AsyncRoute):
+        reason = traffic.should_block(route.request)
+        if reason:
+            traffic.blocked[reason] += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    context.on("response", traffic.record_response)
+    if lightweight:
+        await context.route("**/*", handle_route)
+    return traffic
+
+
+def goto(page: Page, url: str, lightweight: bool):
+    # Blocking is the context's job, see watch
+    page.goto(url, wait_until="domcontentloaded" if lightweight else "load")
+
+
+async def goto_async(page: AsyncPage, url: str, lightweight: bool, timeout: float):
+    await page.goto(
+        url,
+        wait_until="domcontentloaded" if lightweight else "load",
+        timeout=timeout * 1000,
+    )
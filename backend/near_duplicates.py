@@ -0,0 +1,106 @@
+import hashlib
+import random
+import re
+from typing import Optional
+
+from pymongo import ASCENDING
+from pymongo.database import Collection
+
+from structs import PageContent
+
+SHINGLE_WORDS = 5
+PERMUTATIONS = 128
+# 16 bands of 8 rows: pairs become candidates from a Jaccard similarity of about 0.7
+BANDS = 16
+ROWS = PERMUTATIONS // BANDS
+# Estimated Jaccard similarity at which a candidate counts as the same article
+DUPLICATE_THRESHOLD = 0.8
+# Paywall stubs and "enable JavaScript" pages are all alike; too short to sign
+MIN_SHINGLES = 20
+
+MERSENNE_PRIME = (1 << 61) - 1
+# Fixed seed: signatures are persisted and must stay comparable across runs
+_random = random.Random(0xD01025)
+COEFFICIENTS = [
+    (_random.randrange(1, MERSENNE_PRIME), _random.randrange(0, MERSENNE_PRIME))
+    for _ in range(PERMUTATIONS)
+]
+
+
+def shingles(text: str) -> set[int]:
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return set()
+    grams = {
+        " ".join(words[i : i + SHINGLE_WORDS])
+        for i in range(max(1, len(words) - SHINGLE_WORDS + 1))
+    }
+    return {
+        int.from_bytes(hashlib.blake2b(g.encode(), digest_size=8).digest(), "big")
+        for g in grams
+    }
+
+
+def minhash(text: str) -> list[int]:
+    hashes = shingles(text)
+    if len(hashes) < MIN_SHINGLES:
+        return []
+    return [
+        min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in COEFFICIENTS
+    ]
+
+
+def lsh_bands(signature: list[int]) -> list[str]:
+    if not signature:
+        return []
+    bands = []
+    for band in range(BANDS):
+        rows = repr(signature[band * ROWS : (band + 1) * ROWS]).encode()
+        bands.append(f"{band}:{hashlib.blake2b(rows, digest_size=8).hexdigest()}")
+    return bands
+
+
+def similarity(a: list[int], b: list[int]) -> float:
+    if not a or len(a) != len(b):
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class NearDuplicateIndex:
+    """Finds already parsed articles whose text is nearly the same as a new one.
+
+    Signatures and their LSH band keys are stored on the page_content
+    documents themselves, with a multikey index on the band keys, so a
+    lookup is a single indexed query.
+    """
+
+    content_collection: Collection
+
+    def __init__(self, content_collection: Collection):
+        self.content_collection = content_collection
+        self.content_collection.create_index([("lsh_bands", ASCENDING)])
+
+    def mark(self, page_content: PageContent):
+        """Fills in the signature fields, and ``duplicate_of`` if there is an original."""
+        page_content.minhash = minhash(page_content.text)
+        page_content.lsh_bands = lsh_bands(page_content.minhash)
+        page_content.duplicate_of = self.find_original(page_content)
+
+    def find_original(self, page_content: PageContent) -> Optional[str]:
+        if not page_content.lsh_bands:
+            return None
+
+        best_id, best_similarity = None, DUPLICATE_THRESHOLD
+        for candidate in self.content_collection.find(
+            {
+                "lsh_bands": {"$in": page_content.lsh_bands},
+                "_id": {"$ne": page_content._id},
+            },
+            projection={"minhash": 1, "duplicate_of": 1},
+        ):
+            score = similarity(page_content.minhash, candidate["minhash"])
+            if score >= best_similarity:
+                # Point at the original, never at another duplicate
+                best_id = candidate.get("duplicate_of") or candidate["_id"]
+                best_similarity = score
+        return best_id
@@ -3,9 +3,17 @@ import logging
 
 from pymongo import MongoClient
 from pymongo.database import Collection
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+from analysis_cache import AnalysisCache, cache_key
+from feed_view import FeedView
+from jobs import JobQueue, JobState, worker_id
+from llm import AnalysisStats, LmStudioModel, Model, OpenAiModel
+from pending import find_pending
+from schedule import AdaptiveSchedule
 from structs import PageContent, Analysis, LlmAnalysis
-import lmstudio as lms
-import random
+from text_budget import chunk, estimate_tokens, strip_boilerplate
 import time
 import dataclasses
 import json
@@ -27,34 +35,112 @@ pipeline = [
 class Analyzer:
     metadata_collection: Collection
     analysis_collection: Collection
-    model: lms.LLM
+    jobs: JobQueue
+    model: Model
+    cache: AnalysisCache
+    schedule: AdaptiveSchedule
+    feed_view: FeedView
+    token_budget: int
+    max_in_flight: int
+    original_wait: timedelta
+    stats: AnalysisStats
     system_prompt: str
 
     def __init__(
-        self, metadata_collection: Collection, analysis_collection: Collection
+        self,
+        metadata_collection: Collection,
+        analysis_collection: Collection,
+        jobs: JobQueue,
+        model: Model,
+        cache: AnalysisCache,
+        schedule: AdaptiveSchedule,
+        feed_view: FeedView,
+        token_budget: int = 6000,
+        max_in_flight: int = 4,
+        original_wait: timedelta = timedelta(hours=6),
     ) -> None:
         self.metadata_collection = metadata_collection
         self.analysis_collection = analysis_collection
-        self.model = lms.llm()
+        self.jobs = jobs
+        self.model = model
+        self.cache = cache
+        self.schedule = schedule
+        self.feed_view = feed_view
+        self.token_budget = token_budget
+        self.max_in_flight = max_in_flight
+        self.original_wait = original_wait
+        self.stats = AnalysisStats()
         with open("./analysis_prompt.md") as f:
             self.system_prompt = f.read()
 
-    def analyze(self, document: dict) -> Analysis:
-        title: str = document["title"]
-        text: str = document["text"]
-        logging.info('Analyzing: "%s"', title)
-
+    def respond(self, title: str, text: str) -> tuple[LlmAnalysis, int]:
         prompt = f"""Title: {title}
 Content: {text}
 """
-        chat = lms.Chat(
-            initial_prompt=self.system_prompt,
+        start = time.monotonic()
+        try:
+            response = self.model.respond(self.system_prompt, prompt, LlmAnalysis)
+        except Exception:
+            self.stats.record_failure()
+            raise
+        self.stats.record(response, time.monotonic() - start)
+
+        llm_analysis = LlmAnalysis.model_validate_json(response.content, strict=True)
+        return llm_analysis, response.prompt_tokens + response.predicted_tokens
+
+    def respond_in_chunks(
+        self, title: str, chunks: list[str]
+    ) -> tuple[LlmAnalysis, int]:
+        # Map: analyze each part of the article on its own
+        partials = []
+        tokens = 0
+        for i, text in enumerate(chunks):
+            partial, partial_tokens = self.respond(
+                f"{title} (part {i + 1} of {len(chunks)})", text
+            )
+            partials.append(partial)
+            tokens += partial_tokens
+
+        # Reduce: let the model merge the parts' takeaways into one analysis
+        takeaways = "\n".join(
+            f"* {takeaway}" for partial in partials for takeaway in partial.takeaways
+        )
+        search_terms = ", ".join(
+            sorted({term for partial in partials for term in partial.search_terms})
         )
-        chat.add_user_message(prompt)
+        merged, merge_tokens = self.respond(
+            title,
+            f"""The article was too long to read at once. These are the takeaways from each part, in order:
+{takeaways}
 
-        response = self.model.respond(chat, response_format=LlmAnalysis)
+These are the search terms found in its parts: {search_terms}
+""",
+        )
+        return merged, tokens + merge_tokens
 
-        llm_analysis = LlmAnalysis.model_validate_json(response.content, strict=True)
+    def analyze(self, document: dict) -> Analysis:
+        title: str = document["title"]
+        text: str = document["text"]
+        logging.info('Analyzing: "%s"', title)
+
+        key = cache_key(title, text, self.system_prompt, self.model.id)
+        llm_analysis = self.cache.get(key)
+        if llm_analysis:
+            logging.info("Cached analysis: %s", title)
+        else:
+            paragraphs = strip_boilerplate(text)
+            article_text = "\n\n".join(paragraphs)
+            if estimate_tokens(article_text) <= self.token_budget:
+                llm_analysis, tokens = self.respond(title, article_text)
+                chunk_count = 1
+            else:
+                chunks = chunk(paragraphs, self.token_budget)
+                llm_analysis, tokens = self.respond_in_chunks(title, chunks)
+                chunk_count = len(chunks)
+            logging.info(
+                "Spent %d tokens on %d chunk(s): %s", tokens, chunk_count, title
+            )
+            self.cache.put(key, llm_analysis)
 
         # Remove terms that don't exist in the original text.
         # The AI refuses to follow the rules sometimes.
@@ -63,34 +149,131 @@ Content: {text}
         )
 
         analysis = Analysis.from_llm_analysis(document["_id"], llm_analysis)
+        self.stats.record_article()
 
         logging.info("Analysis complete: %s", title)
 
         return analysis
 
-    def loop(self):
-        logging.info("Starting Analysis Loop")
-        while True:
-            # Analyze page content that's not part of a story
-            article_documents = self.metadata_collection.aggregate(pipeline)
-            for document in article_documents:
-                if self.analysis_collection.find_one({"_id": document["_id"]}):
+    def copy_original(self, document: dict) -> Optional[Analysis]:
+        # Near-duplicates share the original's analysis instead of paying for inference
+        original = self.analysis_collection.find_one({"_id": document["duplicate_of"]})
+        if not original:
+            return None
+        logging.info('Reusing analysis of %s: "%s"', original["_id"], document["title"])
+        return Analysis.from_original(document["_id"], original)
+
+    def should_wait_for_original(self, document: dict) -> bool:
+        original_id = document["duplicate_of"]
+        if self.jobs.state(original_id) == JobState.Failed:
+            logging.info(
+                "Original %s failed, analyzing %s itself", original_id, document["_id"]
+            )
+            return False
+        if self.jobs.deferred_longer_than(document["_id"], self.original_wait):
+            logging.info(
+                "Gave up waiting for %s, analyzing %s itself", original_id, document["_id"]
+            )
+            return False
+        return True
+
+    def enqueue_pending(self):
+        # Parsed pages that haven't been analyzed yet
+        for batch in find_pending(
+            self.metadata_collection, self.analysis_collection, then=pipeline
+        ):
+            self.jobs.enqueue([document["_id"] for document in batch])
+
+    def analyze_leased(self, worker: str):
+        while item_id := self.jobs.lease(worker):
+            try:
+                documents = list(
+                    self.metadata_collection.aggregate(
+                        [{"$match": {"_id": item_id}}, *pipeline]
+                    )
+                )
+                if not documents:
+                    self.jobs.complete(item_id, worker)
+                    continue
+                if self.analysis_collection.find_one({"_id": item_id}):
+                    # A previous attempt may have failed between the insert and
+                    # the feed update; adding again is idempotent
+                    self.feed_view.add(item_id)
+                    self.jobs.complete(item_id, worker)
                     continue
 
-                analysis = self.analyze(document)
+                document = documents[0]
+                analysis = None
+                if document.get("duplicate_of"):
+                    analysis = self.copy_original(document)
+                    if analysis is None and self.should_wait_for_original(document):
+                        # Waiting isn't failing, so it doesn't use up attempts
+                        self.jobs.defer(
+                            item_id,
+                            worker,
+                            self.jobs.backoff,
+                            f"{document['duplicate_of']} is not analyzed yet",
+                        )
+                        continue
+                if analysis is None:
+                    analysis = self.analyze(document)
                 self.analysis_collection.insert_one(dataclasses.asdict(analysis))
+                self.feed_view.add(item_id)
+                self.jobs.complete(item_id, worker)
+            except Exception as e:
+                logging.error("Failed to analyze %s: %s", item_id, e)
+                self.jobs.fail(item_id, worker, str(e))
 
-            # Sleep for 2 to 5 minutes
-            duration = random.randint(60 * 2, 60 * 5)
-            logging.info(
-                "Sleeping for %d minutes, %d seconds...", duration // 60, duration % 60
-            )
-            time.sleep(duration)
+    def loop(self):
+        logging.info("Starting Analysis Loop")
+        # The job queue is the request queue. Each worker keeps one request
+        # in flight, so the model host always has the next article waiting.
+        thread_pool = ThreadPoolExecutor(
+            max_workers=self.max_in_flight, thread_name_prefix="analyzer"
+        )
+        while True:
+            start = time.monotonic()
+            self.enqueue_pending()
+            workers = [
+                thread_pool.submit(lambda: self.analyze_leased(worker_id()))
+                for _ in range(self.max_in_flight)
+            ]
+            for worker in workers:
+                worker.result()
+            self.stats.record_cycle(time.monotonic() - start)
+            self.stats.log(logging.getLogger())
+            self.cache.log(logging.getLogger())
+            self.schedule.sleep()
 
 
 def main():
     parser = argparse.ArgumentParser(description="Page Analyzer")
-    parser.parse_args()
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=4,
+        help="Analysis requests sent to the model at once",
+    )
+    parser.add_argument(
+        "--openai-base-url",
+        help="Use an OpenAI-compatible server (e.g. http://localhost:8080/v1) instead of LM Studio",
+    )
+    parser.add_argument(
+        "--openai-model", default="local", help="Model name for --openai-base-url"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=50_000,
+        help="Cached analyses to keep before evicting the least recently used",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        default=6000,
+        help="Article tokens per request; longer articles are analyzed in chunks",
+    )
+    args = parser.parse_args()
 
     logging.basicConfig(format="%(asctime)s | %(levelname)-7s | %(message)s")
     logging.getLogger().setLevel(logging.INFO)
@@ -101,7 +284,38 @@ def main():
     metadata_collection = db.page_metadata
     analysis_collection = db.page_analysis
 
-    analyzer = Analyzer(metadata_collection, analysis_collection)
+    jobs = JobQueue(db.jobs, "analyze")
+
+    model: Model
+    if args.openai_base_url:
+        model = OpenAiModel(args.openai_base_url, args.openai_model)
+    else:
+        model = LmStudioModel()
+
+    cache = AnalysisCache(db.analysis_cache, args.cache_size)
+
+    feed_view = FeedView(db.feed, metadata_collection)
+    if feed_view.feed_collection.estimated_document_count() == 0:
+        feed_view.rebuild()
+
+    analyzer = Analyzer(
+        metadata_collection,
+        analysis_collection,
+        jobs,
+        model,
+        cache,
+        # New pages arrive at the rate the watchers ingest them
+        AdaptiveSchedule(
+            metadata_collection,
+            db.schedule,
+            "page_analyzer",
+            min_interval=30,
+            max_interval=60 * 10,
+        ),
+        feed_view,
+        args.token_budget,
+        args.max_in_flight,
+    )
     analyzer.loop()
 
 
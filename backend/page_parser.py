@@ -1,66 +1,331 @@
 import argparse
+import asyncio
 import logging
-from datetime import datetime, timezone
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+from typing import Callable
 from zoneinfo import ZoneInfo
 
-from concurrent.futures import ThreadPoolExecutor, Future
+from collections import defaultdict
+from playwright.async_api import async_playwright
+from playwright.sync_api import Page
 from pymongo import MongoClient
 from pymongo.database import Collection
 
+from browser_pool import AsyncBrowserPool, BrowserPool
+from change_feed import ChangeFeed
+from jobs import JobQueue, worker_id
+from pending import find_pending
+from schedule import AdaptiveSchedule
+from near_duplicates import NearDuplicateIndex
+from static_extractor import StaticExtractor
 from structs import PageMetadata, PageContent
 
 import dataclasses
-import random
+import threading
 import time
 
+# How often to log pool and tier stats while following new articles
+STATS_INTERVAL = 10 * 60
+# How long an idle worker waits before asking the job queue again
+POLL_INTERVAL = 5
+# How long a job waits for its host to have a free slot
+HOST_BUSY_DELAY = timedelta(seconds=30)
+
+
+def pending_metadata(
+    metadata_collection: Collection, content_collection: Collection
+) -> list[PageMetadata]:
+    pending = []
+    for batch in find_pending(metadata_collection, content_collection):
+        pending.extend(PageMetadata(**metadata_str) for metadata_str in batch)
+    return pending
+
+
+def enqueue_new_pages(
+    metadata_collection: Collection,
+    content_collection: Collection,
+    feed: ChangeFeed,
+    jobs: JobQueue,
+    stats: Callable[[], None],
+):
+    # Catch up on whatever arrived while we were down...
+    pending = pending_metadata(metadata_collection, content_collection)
+    logging.info("Enqueuing %d pending pages...", len(pending))
+    jobs.enqueue([metadata._id for metadata in pending])
+
+    # ...then enqueue new articles as soon as they are inserted
+    last_stats = time.monotonic()
+    for document in feed.follow():
+        jobs.enqueue([document["_id"]])
+
+        if time.monotonic() - last_stats > STATS_INTERVAL:
+            stats()
+            last_stats = time.monotonic()
+
 
 class PageParser:
     metadata_collection: Collection
     content_collection: Collection
+    browser_pool: BrowserPool
+    static_extractor: StaticExtractor
+    duplicates: NearDuplicateIndex
+    feed: ChangeFeed
+    jobs: JobQueue
+    lightweight: bool
 
     def __init__(
         self,
         metadata_collection: Collection,
         content_collection: Collection,
+        browser_pool: BrowserPool,
+        static_extractor: StaticExtractor,
+        duplicates: NearDuplicateIndex,
+        feed: ChangeFeed,
+        jobs: JobQueue,
+        lightweight: bool = True,
     ):
         self.metadata_collection = metadata_collection
         self.content_collection = content_collection
+        self.browser_pool = browser_pool
+        self.static_extractor = static_extractor
+        self.duplicates = duplicates
+        self.feed = feed
+        self.jobs = jobs
+        self.lightweight = lightweight
+
+    def parse_page(self, page: Page, metadata: PageMetadata):
+        return PageContent.from_metadata(metadata, page, self.lightweight)
+
+    def parse(self, metadata: PageMetadata) -> bool:
+        page_content = None
+        if self.static_extractor.should_try(metadata.url):
+            page_content = self.static_extractor.extract(metadata)
+
+        if not page_content:
+            try:
+                page_content = self.browser_pool.submit(
+                    self.parse_page, metadata
+                ).result()
+            except Exception as e:
+                # The pool has already recycled the page and counted the failure
+                logging.error("Browser failed on %s: %s", metadata.url, e)
+            self.static_extractor.record_browser(metadata.url)
 
-    def parse(self, metadata: PageMetadata):
-        page_content = PageContent.from_metadata(metadata)
         if not page_content:
             logging.error("Failed to parse %s", metadata.url)
-            return
+            return False
+
+        self.duplicates.mark(page_content)
+        if page_content.duplicate_of:
+            logging.info("%s duplicates %s", metadata.url, page_content.duplicate_of)
 
         # Add the page content to MongoDB
         self.content_collection.insert_one(dataclasses.asdict(page_content))
+        return True
+
+    def work_loop(self):
+        worker = worker_id()
+        while True:
+            item_id = self.jobs.lease(worker)
+            if item_id is None:
+                self.jobs.wait(POLL_INTERVAL)
+                continue
+
+            try:
+                metadata_str = self.metadata_collection.find_one({"_id": item_id})
+                # Already parsed, e.g. by another worker before a lease expired
+                if not metadata_str or self.content_collection.find_one(
+                    {"_id": item_id}
+                ):
+                    self.jobs.complete(item_id, worker)
+                    continue
+
+                if self.parse(PageMetadata(**metadata_str)):
+                    self.jobs.complete(item_id, worker)
+                else:
+                    self.jobs.fail(item_id, worker, "no content")
+            except Exception as e:
+                logging.error("Failed to parse %s: %s", item_id, e)
+                self.jobs.fail(item_id, worker, str(e))
+
+    def log_stats(self):
+        self.browser_pool.stats.log(logging.getLogger())
+        self.static_extractor.log(logging.getLogger())
 
     def parse_loop(self):
         logging.info("Starting Parse Loop")
-        thread_pool = ThreadPoolExecutor(max_workers=5)
+        # Pages that need a browser are handed on from the workers to the browser pool
+        for i in range(self.browser_pool.browsers * 2):
+            thread = threading.Thread(name=f"parser-{i}", target=self.work_loop)
+            thread.daemon = True
+            thread.start()
+
+        enqueue_new_pages(
+            self.metadata_collection,
+            self.content_collection,
+            self.feed,
+            self.jobs,
+            self.log_stats,
+        )
+
+
+class AsyncPageParser:
+    """Keeps many page loads in flight on one event loop instead of one thread each."""
+
+    metadata_collection: Collection
+    content_collection: Collection
+    browser_pool: AsyncBrowserPool
+    static_extractor: StaticExtractor
+    duplicates: NearDuplicateIndex
+    feed: ChangeFeed
+    jobs: JobQueue
+    concurrency: int
+    per_host: int
+    timeout: float
+    lightweight: bool
 
+    def __init__(
+        self,
+        metadata_collection: Collection,
+        content_collection: Collection,
+        browser_pool: AsyncBrowserPool,
+        static_extractor: StaticExtractor,
+        duplicates: NearDuplicateIndex,
+        feed: ChangeFeed,
+        jobs: JobQueue,
+        concurrency: int = 50,
+        per_host: int = 4,
+        timeout: float = 30,
+        lightweight: bool = True,
+    ):
+        self.metadata_collection = metadata_collection
+        self.content_collection = content_collection
+        self.browser_pool = browser_pool
+        self.static_extractor = static_extractor
+        self.duplicates = duplicates
+        self.feed = feed
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.lightweight = lightweight
+        self.hosts: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.per_host)
+        )
+
+    def host_of(self, metadata: PageMetadata) -> str:
+        return urllib.parse.urlparse(metadata.url).hostname or ""
+
+    async def parse(self, metadata: PageMetadata) -> bool:
+        async with self.hosts[self.host_of(metadata)]:
+            page_content = None
+            if self.static_extractor.should_try(metadata.url):
+                page_content = await asyncio.to_thread(
+                    self.static_extractor.extract, metadata
+                )
+
+            if not page_content:
+                try:
+                    async with self.browser_pool.page() as page:
+                        # Bound the whole checkout, not just goto, so a hung
+                        # extraction can't hold a page forever
+                        page_content = await asyncio.wait_for(
+                            PageContent.from_metadata_async(
+                                metadata, page, self.timeout, self.lightweight
+                            ),
+                            self.timeout * 2,
+                        )
+                except asyncio.TimeoutError:
+                    logging.error("Timed out parsing %s", metadata.url)
+                    return False
+                except Exception as e:
+                    # The pool has already recycled the page and counted the failure
+                    logging.error("Browser failed on %s: %s", metadata.url, e)
+                self.static_extractor.record_browser(metadata.url)
+
+        if not page_content:
+            logging.error("Failed to parse %s", metadata.url)
+            return False
+
+        await asyncio.to_thread(self.duplicates.mark, page_content)
+        if page_content.duplicate_of:
+            logging.info("%s duplicates %s", metadata.url, page_content.duplicate_of)
+
+        # Add the page content to MongoDB
+        await asyncio.to_thread(
+            self.content_collection.insert_one, dataclasses.asdict(page_content)
+        )
+        return True
+
+    async def work_loop(self, worker: str):
+        # Each of the --concurrency workers holds at most one page load in flight
         while True:
-            # Send all metadata to the thread pool for parsing
-            futures: list[Future] = []
-            for metadata_str in self.metadata_collection.find():
-                metadata = PageMetadata(**metadata_str)
+            item_id = await asyncio.to_thread(self.jobs.lease, worker)
+            if item_id is None:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
 
-                if self.content_collection.find_one({"_id": metadata._id}):
+            try:
+                metadata_str = await asyncio.to_thread(
+                    self.metadata_collection.find_one, {"_id": item_id}
+                )
+                parsed = await asyncio.to_thread(
+                    self.content_collection.find_one, {"_id": item_id}
+                )
+                if not metadata_str or parsed:
+                    await asyncio.to_thread(self.jobs.complete, item_id, worker)
                     continue
 
-                future = thread_pool.submit(self.parse, metadata)
-                futures.append(future)
+                metadata = PageMetadata(**metadata_str)
+                host = self.host_of(metadata)
+                if self.hosts[host].locked():
+                    # Waiting would hold this worker and the lease while
+                    # other hosts' jobs queue up behind it
+                    await asyncio.to_thread(
+                        self.jobs.defer,
+                        item_id,
+                        worker,
+                        HOST_BUSY_DELAY,
+                        f"{host} is busy",
+                    )
+                    continue
+
+                # No await before parse takes the host's slot, so it's still free
+                if await self.parse(metadata):
+                    await asyncio.to_thread(self.jobs.complete, item_id, worker)
+                else:
+                    await asyncio.to_thread(self.jobs.fail, item_id, worker, "no content")
+            except Exception as e:
+                logging.error("Failed to parse %s: %s", item_id, e)
+                await asyncio.to_thread(self.jobs.fail, item_id, worker, str(e))
 
-            logging.info("Waiting for all pages to parse...")
-            for future in futures:
-                future.result()
+    def log_stats(self):
+        self.browser_pool.stats.log(logging.getLogger())
+        self.static_extractor.log(logging.getLogger())
 
-            # Sleep for 2 to 5 minutes
-            duration = random.randint(60 * 2, 60 * 5)
-            logging.info(
-                "Sleeping for %d minutes, %d seconds...", duration // 60, duration % 60
-            )
-            time.sleep(duration)
+    async def parse_loop(self):
+        logging.info("Starting Async Parse Loop")
+        async with async_playwright() as p:
+            await self.browser_pool.start(p)
+            try:
+                workers = [
+                    asyncio.create_task(self.work_loop(f"{worker_id()}:{i}"))
+                    for i in range(self.concurrency)
+                ]
+                await asyncio.gather(
+                    asyncio.to_thread(
+                        enqueue_new_pages,
+                        self.metadata_collection,
+                        self.content_collection,
+                        self.feed,
+                        self.jobs,
+                        self.log_stats,
+                    ),
+                    *workers,
+                )
+            finally:
+                await self.browser_pool.close()
 
 
 def now() -> datetime:
@@ -69,7 +334,58 @@ def now() -> datetime:
 
 def main():
     parser = argparse.ArgumentParser(description="Page Parser")
-    parser.parse_args()
+    parser.add_argument(
+        "--browsers", type=int, default=5, help="Number of pooled Chromium browsers"
+    )
+    parser.add_argument(
+        "--max-navigations",
+        type=int,
+        default=50,
+        help="Navigations before a browser context is recycled",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "async"],
+        default="threads",
+        help="Parse with a thread per browser or with playwright.async_api",
+    )
+    parser.add_argument(
+        "--pages-per-browser",
+        type=int,
+        default=25,
+        help="Reusable pages per browser (async engine only)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=50,
+        help="Maximum page loads in flight (async engine only)",
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=4,
+        help="Maximum page loads in flight per host (async engine only)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30,
+        help="Per-navigation timeout in seconds (async engine only)",
+    )
+    parser.add_argument(
+        "--lightweight",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Block images, media, fonts and third-party scripts on pooled pages",
+    )
+    parser.add_argument(
+        "--min-static-length",
+        type=int,
+        default=500,
+        help="Characters of static HTML text needed to skip the browser",
+    )
+    args = parser.parse_args()
 
     logging.basicConfig(format="%(asctime)s | %(levelname)-7s | %(message)s")
     logging.getLogger().setLevel(logging.INFO)
@@ -80,8 +396,60 @@ def main():
     metadata_collection = db.page_metadata
     content_collection = db.page_content
 
-    page_parser = PageParser(metadata_collection, content_collection)
-    page_parser.parse_loop()
+    # Hacker News leaves the blogs it classified in page_html
+    static_extractor = StaticExtractor(
+        args.min_static_length, html_collection=db.page_html
+    )
+    duplicates = NearDuplicateIndex(content_collection)
+    # Only used to pace polling when MongoDB can't provide a change stream
+    schedule = AdaptiveSchedule(
+        metadata_collection,
+        db.schedule,
+        "page_parser",
+        min_interval=5,
+        max_interval=60,
+        target_per_run=1,
+    )
+    feed = ChangeFeed(
+        metadata_collection, db.pipeline_state, "page_parser", schedule=schedule
+    )
+    jobs = JobQueue(db.jobs, "parse")
+
+    if args.engine == "async":
+        async_pool = AsyncBrowserPool(
+            args.browsers, args.pages_per_browser, args.max_navigations, args.lightweight
+        )
+        async_parser = AsyncPageParser(
+            metadata_collection,
+            content_collection,
+            async_pool,
+            static_extractor,
+            duplicates,
+            feed,
+            jobs,
+            args.concurrency,
+            args.per_host,
+            args.timeout,
+            args.lightweight,
+        )
+        asyncio.run(async_parser.parse_loop())
+        return
+
+    browser_pool = BrowserPool(args.browsers, args.max_navigations, args.lightweight)
+    page_parser = PageParser(
+        metadata_collection,
+        content_collection,
+        browser_pool,
+        static_extractor,
+        duplicates,
+        feed,
+        jobs,
+        args.lightweight,
+    )
+    try:
+        page_parser.parse_loop()
+    finally:
+        browser_pool.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+from typing import Iterator, Optional
+
+from pymongo.database import Collection
+
+
+def find_pending(
+    source: Collection,
+    done: Collection,
+    then: Optional[list[dict]] = None,
+    batch_size: int = 500,
+) -> Iterator[list[dict]]:
+    """Yields batches of documents in ``source`` whose _id is not yet in ``done``.
+
+    Each batch is a single aggregation that anti-joins against ``done``, so
+    finding work costs one round-trip per batch instead of one per document.
+    Batches are paginated on _id, so work inserted into ``done`` while the
+    caller processes a batch doesn't shift the next page. ``then`` stages run
+    on the pending documents only, before the batch is cut.
+    """
+    last_id = None
+    while True:
+        match = {} if last_id is None else {"_id": {"$gt": last_id}}
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"_id": 1}},
+            {
+                "$lookup": {
+                    "from": done.name,
+                    "localField": "_id",
+                    "foreignField": "_id",
+                    # Only existence matters; don't drag whole documents along
+                    "pipeline": [{"$project": {"_id": 1}}],
+                    "as": "done",
+                }
+            },
+            {"$match": {"done": {"$size": 0}}},
+            {"$project": {"done": 0}},
+            *(then or []),
+            {"$limit": batch_size},
+        ]
+        batch = list(source.aggregate(pipeline))
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]["_id"]
@@ -1,345 +1,175 @@
-from typing import List
-
-import requests
-import xmltodict
-import html
-
-from structs import PageMetadata
-
-from pymongo.database import Collection
-from pymongo.errors import BulkWriteError
-from datetime import datetime, timezone
-
-from threading import Thread
-import logging
-import random
-import time
 import dataclasses
-from bs4 import BeautifulSoup
-
-
-def get_authors(entry: dict) -> List[str]:
-    if "dc:creator" in entry:
-        return [entry["dc:creator"]]
-    elif "author" in entry:
-        if isinstance(entry["author"], list):
-            return [author["name"] for author in entry["author"]]
-        elif isinstance(entry["author"], dict) and "name" in entry["author"]:
-            return [entry["author"]["name"]]
-        elif isinstance(entry["author"], str):
-            return [entry["author"]]
-    raise AssertionError("Unknown author type")
-
-
-def get_xml(url: str) -> dict:
-    response = requests.get(url, headers={"User-Agent": "Dolores/1.0"})
-    response.raise_for_status()
-    rss = xmltodict.parse(response.text)
-    return rss
-
-
-def get_categories(entry: dict) -> List[str]:
-    if "catgory" not in entry:
-        return []
-    if isinstance(entry["category"], str):
-        return [entry["category"]]
-    if isinstance(entry["category"], dict):
-        return [entry["category"]["@term"]]
-    if isinstance(entry["category"], list):
-        if entry["category"]:
-            return []
-        elif isinstance(entry["category"][0], str):
-            return entry["category"]
-        else:
-            return [category["@term"] for category in entry["category"]]
-    assert "Unexpected"
-    return []
-
+import json
+import logging
+from datetime import datetime
+from typing import Iterator, List, Optional
 
-class RssProvider:
-    collection: Collection
-    after: datetime
-    thread: Thread
-    logger: logging.Logger
+from bs4 import BeautifulSoup
 
-    def __init__(self, collection: Collection, after: datetime):
-        self.logger = logging.getLogger(self.__class__.__name__)
-        self.collection = collection
-        self.after = after
-        self.thread = Thread(
-            name=self.__class__.__name__.lower(),
-            target=self.rss_loop,
-        )
-        self.thread.daemon = True
-        self.thread.start()
+from feed_fetcher import FeedFetcher
+from feed_parser import FeedEntry, parse_feed
+from structs import PageMetadata
 
-    def get_rss(self) -> List[PageMetadata]:
-        return []
 
-    def rss_loop(self):
-        self.logger.info("Starting RSS Loop")
-        while True:
+@dataclasses.dataclass
+class FeedConfig:
+    """How to turn one RSS or Atom feed into page metadata.
+
+    ``link_from`` picks the article URL: ``"link"`` for the entry's own link,
+    another link ``rel`` such as ``"shorturl"``, or ``"content"`` for the
+    ``[link]`` anchors in the entry body (link aggregators like Reddit).
+    ``discussion_url`` is a template over the entry's own ``{link}``.
+    """
+
+    source: str
+    url: str
+    link_from: str = "link"
+    discussion_url: str = ""
+    # Some feeds put the subreddit or site name after a separator in the title
+    title_separator: Optional[str] = None
+    exclude_titles: list[str] = dataclasses.field(default_factory=list)
+    exclude_ids: list[str] = dataclasses.field(default_factory=list)
+    # Feeds sorted by date can stop at the first entry that was read before
+    newest_first: bool = True
+    enabled: bool = True
+
+    def excludes(self, entry: FeedEntry) -> bool:
+        if any(word in entry.title for word in self.exclude_titles):
+            return True
+        return any(word in (entry.id or "") for word in self.exclude_ids)
+
+    def article_urls(self, entry: FeedEntry) -> list[str]:
+        if self.link_from == "content":
+            soup = BeautifulSoup(entry.content, features="html.parser")
+            return [
+                link["href"]
+                for link in soup.find_all("a", href=True)
+                if "[link]" in link.get_text()
+            ]
+        if self.link_from == "link":
+            return [entry.link]
+        return [entry.links[self.link_from]] if self.link_from in entry.links else []
+
+
+FEEDS = [
+    FeedConfig(
+        source="Reddit",
+        url="https://www.reddit.com/r/technology.rss",
+        link_from="content",
+        discussion_url="{link}",
+        title_separator="|",
+        # Sorted by hot rather than by date
+        newest_first=False,
+    ),
+    FeedConfig(
+        source="The Verge",
+        url="https://www.theverge.com/rss/index.xml",
+        discussion_url="{link}#comments",
+    ),
+    FeedConfig(
+        source="Hackaday",
+        url="https://hackaday.com/blog/feed/",
+        discussion_url="{link}#comments",
+    ),
+    FeedConfig(
+        source="XDA Developers",
+        url="https://www.xda-developers.com/feed/",
+        discussion_url="{link}#threads",
+    ),
+    FeedConfig(
+        source="Ars Technica",
+        url="https://feeds.arstechnica.com/arstechnica/index",
+        enabled=False,
+    ),
+    FeedConfig(
+        source="Engadget",
+        url="https://www.engadget.com/rss-full.xml",
+        enabled=False,
+    ),
+    FeedConfig(
+        source="TechRadar",
+        url="https://www.techradar.com/rss",
+        exclude_titles=["Wordle", "NYT"],
+        # Regularly can't load pages
+        enabled=False,
+    ),
+    FeedConfig(
+        source="MIT Technology Review",
+        url="https://www.technologyreview.com/feed/",
+        enabled=False,
+    ),
+    FeedConfig(
+        source="OS News",
+        url="http://www.osnews.com/files/recent.xml",
+        enabled=False,
+    ),
+    FeedConfig(
+        source="BBC",
+        url="http://feeds.bbci.co.uk/news/rss.xml",
+        enabled=False,
+    ),
+    FeedConfig(
+        source="Daring Fireball",
+        url="https://daringfireball.net/feeds/main",
+        link_from="shorturl",
+        # We want Gruber's pieces, not others'
+        exclude_ids=["sponsors", "linked"],
+        enabled=False,
+    ),
+]
+
+
+def load_feeds(path: Optional[str]) -> List[FeedConfig]:
+    """Returns the enabled feeds from a JSON list of FeedConfig fields, or the built-in ones."""
+    if path is None:
+        feeds = FEEDS
+    else:
+        with open(path) as f:
+            feeds = [FeedConfig(**config) for config in json.load(f)]
+    return [feed for feed in feeds if feed.enabled]
+
+
+def entries(
+    feed: FeedConfig, fetcher: FeedFetcher, after: datetime
+) -> Iterator[FeedEntry]:
+    """Streams the feed's entries, or nothing if it hasn't changed.
+
+    Feeds listed newest first stop at the first entry older than ``after``,
+    since everything past it has been read before.
+    """
+    with fetcher.open(feed.url) as stream:
+        if stream is None:
+            return
+        for entry in parse_feed(stream):
+            published = entry.published_at()
+            if feed.newest_first and published and published < after:
+                return
+            yield entry
+
+
+def read_feed(
+    feed: FeedConfig, fetcher: FeedFetcher, after: datetime
+) -> List[PageMetadata]:
+    metadata = []
+    for entry in entries(feed, fetcher, after):
+        if feed.excludes(entry):
+            continue
+
+        title = entry.title
+        if feed.title_separator:
+            title = title.split(feed.title_separator)[0]
+
+        for url in feed.article_urls(entry):
             try:
-                all_metadata: List[PageMetadata] = self.get_rss()
-
-                # Filter and convert to JSON dicts
-                new_metadata = [
-                    dataclasses.asdict(a)
-                    for a in filter(
-                        lambda a: a.published_after(self.after), all_metadata
-                    )
-                ]
-
-                self.after = datetime.now().astimezone(timezone.utc)
-
-                self.logger.info("Read %d RSS articles", len(new_metadata))
-
-                # Commit to MongoDB
-                if new_metadata:
-                    self.collection.insert_many(new_metadata, ordered=False)
-            except BulkWriteError as bwe:
-                for error in bwe.details["writeErrors"]:
-                    if error["code"] == 11000:
-                        self.logger.warning("Duplicate article")
-                    else:
-                        self.logger.error("Bulk write error: %s", error)
-                        raise bwe
-            except Exception as e:
-                self.logger.error("Failed to fetch RSS: %s", e)
-
-            # Sleep for 5 to 10 minutes
-            duration = random.randint(5 * 60, 10 * 60)
-            self.logger.info(
-                "Sleeping for %d minutes, %d seconds", duration // 60, duration % 60
-            )
-            time.sleep(duration)
-
-
-
-class RedditTech(RssProvider):
-    def get_rss(self) -> List[PageMetadata]:
-        xml = get_xml("https://www.reddit.com/r/technology.rss")
-        entries = xml["feed"]["entry"]
-        metadata = []
-
-        for entry in entries:
-            content = entry["content"]["#text"]
-            soup = BeautifulSoup(content, features="html.parser")
-            links = soup.find_all("a", href=True)
-
-            # The first part is the title
-            title = entry["title"]
-            title_parts = title.split("|")
-            title = title_parts[0]
-
-            for link in links:
-                if "[link]" in link.get_text():
-                    metadata.append(
-                        PageMetadata.from_raw(
-                            source="Reddit",
-                            title=title,
-                            url=link["href"],
-                            date=entry["published"],
-                            discussion_url=entry["link"]["@href"],
-                        )
+                metadata.append(
+                    PageMetadata.from_raw(
+                        source=feed.source,
+                        title=title,
+                        url=url,
+                        date=entry.published,
+                        discussion_url=feed.discussion_url.format(link=entry.link),
                     )
-        return metadata
-
-
-class TheVerge(RssProvider):
-    def get_rss(self) -> List[PageMetadata]:
-        xml = get_xml("https://www.theverge.com/rss/index.xml")
-        entries = xml["feed"]["entry"]
-        metadata = []
-
-        for entry in entries:
-            metadata.append(
-                PageMetadata.from_raw(
-                    source="The Verge",
-                    title=entry["title"]["#text"],
-                    url=entry["link"]["@href"],
-                    date=entry["published"],
-                    discussion_url=entry["link"]["@href"] + "#comments",
-                )
-            )
-
-        return metadata
-
-class Hackaday(RssProvider):
-    def get_rss(self) -> List[PageMetadata]:
-        xml = get_xml("https://hackaday.com/blog/feed/")
-        entries = xml["rss"]["channel"]["item"]
-        metadata = []
-        for entry in entries:
-            metadata.append(
-                PageMetadata.from_raw(
-                    source="Hackaday",
-                    title=entry["title"],
-                    url=entry["link"],
-                    date=entry["pubDate"],
-                    discussion_url=entry["link"] + "#comments",
                 )
-            )
-        return metadata
-
-
-class XdaDevelopers(RssProvider):
-    def get_rss(self) -> List[PageMetadata]:
-        xml = get_xml("https://www.xda-developers.com/feed/")
-        entries = xml["rss"]["channel"]["item"]
-        metadata = []
-        for entry in entries:
-            metadata.append(
-                PageMetadata.from_raw(
-                    source="XDA Developers",
-                    title=entry["title"],
-                    url=entry["link"],
-                    date=entry["pubDate"],
-                    discussion_url=entry["link"] + "#threads",
-                )
-            )
-        return metadata
-
-# class ArsTechnica(RssProvider):
-#     def get_rss(self) -> List[PageMetadata]:
-#         xml = get_xml("https://feeds.arstechnica.com/arstechnica/index")
-#         entries = xml["rss"]["channel"]["item"]
-#         metadata = []
-#         for entry in entries:
-#             metadata.append(
-#                 PageMetadata.from_raw(
-#                     source="Ars Technica",
-#                     title=entry["title"],
-#                     url=entry["link"],
-#                     date=entry["pubDate"],
-#                     discussion_url="",
-#                 )
-#             )
-#         return metadata
-
-
-
-
-# class Engadget(RssProvider):
-#     def get_rss(self) -> List[PageMetadata]:
-#         xml = get_xml("https://www.engadget.com/rss-full.xml")
-#         entries = xml["rss"]["channel"]["item"]
-#         metadata = []
-#         for entry in entries:
-#             metadata.append(
-#                 PageMetadata.from_raw(
-#                     source="Engadget",
-#                     title=entry["title"],
-#                     url=entry["link"],
-#                     date=entry["pubDate"],
-#                     discussion_url="",
-#                 )
-#             )
-#         return metadata
-
-
-# class MitTechReview(RssProvider):
-#     def get_rss(self) -> List[PageMetadata]:
-#         xml = get_xml("https://www.technologyreview.com/feed/")
-#         entries = xml["rss"]["channel"]["item"]
-#         metadata = []
-#         for entry in entries:
-#             metadata.append(
-#                 PageMetadata.from_raw(
-#                     source="MIT Technology Review",
-#                     title=entry["title"],
-#                     url=entry["link"],
-#                     date=entry["pubDate"],
-#                     discussion_url="",
-#                 )
-#             )
-#         return metadata
-
-
-# class OsNews(RssProvider):
-#     def get_rss(self) -> List[PageMetadata]:
-#         xml = get_xml("http://www.osnews.com/files/recent.xml")
-#         entries = xml["rss"]["channel"]["item"]
-#         metadata = []
-#         for entry in entries:
-#             metadata.append(
-#                 PageMetadata.from_raw(
-#                     source="OS News",
-#                     title=entry["title"],
-#                     url=entry["link"],
-#                     date=entry["pubDate"],
-#                     discussion_url="",
-#                 )
-#             )
-#         return metadata
-
-
-# class TechRadar(RssProvider):
-#     def get_rss(self) -> List[PageMetadata]:
-#         xml = get_xml("https://www.techradar.com/rss")
-#         entries = xml["rss"]["channel"]["item"]
-#         metadata = []
-#         for entry in entries:
-#             if "Wordle" in entry["title"]:
-#                 continue
-#             if "NYT" in entry["title"]:
-#                 continue
-
-#             metadata.append(
-#                 PageMetadata.from_raw(
-#                     source="TechRadar",
-#                     title=entry["title"],
-#                     url=entry["link"],
-#                     date=entry["pubDate"],
-#                     discussion_url="",
-#                 )
-#             )
-#         return metadata
-
-
-# class BBC(RssProvider):
-#     def get_rss(self) -> List[PageMetadata]:
-#         xml = get_xml("http://feeds.bbci.co.uk/news/rss.xml")
-#         entries = xml["rss"]["channel"]["item"]
-#         metadata = []
-#         for entry in entries:
-#             metadata.append(
-#                 PageMetadata.from_raw(
-#                     source="BBC",
-#                     title=entry["title"],
-#                     url=entry["link"],
-#                     date=entry["pubDate"],
-#                     discussion_url="",
-#                 )
-#             )
-#         return metadata
-
-
-# def read_daring_fireball() -> List[PageMetadata]:
-#     xml = get_xml("https://daringfireball.net/feeds/main")
-#     entries = xml["feed"]["entry"]
-#     metadata = []
-#     for entry in entries:
-#         # We want Gruber's pieces, not others'
-#         if "sponsors" in entry["id"] or "linked" in entry["id"]:
-#             continue
-
-#         url = None
-#         for link in entry["link"]:
-#             if link["@rel"] == "shorturl":
-#                 url = link["@href"]
-#         assert url
-
-#         metadata.append(
-#             PageMetadata(
-#                 source="Daring Fireball",
-#                 title=entry["title"],
-#                 tags=[],
-#                 authors=get_authors(entry),
-#                 text=entry["content"]["#text"],
-#                 url=url,
-#                 _pub_date=entry["published"],
-#             )
-#         )
-
-#     return metadata
\ No newline at end of file
+            except Exception as e:
+                logging.warning("Skipping entry %s in %s: %s", url, feed.source, e)
+    return metadata
@@ -3,21 +3,12 @@ import logging
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
-from rss_providers import *
 from pymongo import MongoClient
 
-ALL_PROVIDERS = [
-    RedditTech,
-    TheVerge,
-    Hackaday,
-    XdaDevelopers,
-    # ArsTechnica,
-    # Engadget,
-    # TechRadar, // Regularly can't load pages
-    # MitTechReview,
-    # OsNews,
-    # BBC
-]
+from feed_fetcher import FeedFetcher
+from feed_scheduler import FeedScheduler
+from rss_providers import load_feeds
+from urls import SeenUrls
 
 
 def now() -> datetime:
@@ -26,7 +17,14 @@ def now() -> datetime:
 
 def main():
     parser = argparse.ArgumentParser(description="RSS Watcher")
-    parser.parse_args()
+    parser.add_argument(
+        "--feeds",
+        help="JSON file of feed configs to use instead of the built-in ones",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="How many feeds to fetch at once"
+    )
+    args = parser.parse_args()
 
     logging.basicConfig(
         format="%(asctime)s | %(levelname)-7s | %(name)-15s | %(message)s"
@@ -41,14 +39,17 @@ def main():
     # Set the time after which to fetch news
     after = now() - timedelta(days=1)
 
-    providers = []
-    for provider_class in ALL_PROVIDERS:
-        provider = provider_class(collection, after)
-        providers.append(provider)
+    # Shared by all feeds, so the same link from two feeds is only inserted once
+    seen = SeenUrls()
+    seen.warm(collection)
+    fetcher = FeedFetcher(db.feed_state)
 
-    for provider in providers:
-        provider.thread.join()
-        logging.info(f"{provider.__class__.__name__} finished processing.")
+    feeds = load_feeds(args.feeds)
+    logging.info("Watching %d feeds", len(feeds))
+    scheduler = FeedScheduler(
+        feeds, collection, db.schedule, seen, fetcher, after, workers=args.workers
+    )
+    scheduler.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo import ASCENDING
+from pymongo.database import Collection
+
+
+class AdaptiveSchedule:
+    """Spaces a poller's runs by how fast the documents it waits for arrive.
+
+    The rate is the number of documents matching ``query`` whose
+    ``field`` falls in the last ``window``. Runs are spaced to see about
+    ``target_per_run`` new documents each, within ``min_interval`` and
+    ``max_interval`` seconds, with jitter so pollers don't line up. Every
+    decision is written to ``schedule_collection`` under ``name``, which is
+    what the API's /schedule shows.
+    """
+
+    collection: Collection
+    schedule_collection: Collection
+    name: str
+    query: dict
+    field: str
+    min_interval: float
+    max_interval: float
+    target_per_run: float
+    window: timedelta
+    jitter: float
+
+    def __init__(
+        self,
+        collection: Collection,
+        schedule_collection: Collection,
+        name: str,
+        min_interval: float,
+        max_interval: float,
+        query: Optional[dict] = None,
+        field: str = "ingested_at",
+        target_per_run: float = 3,
+        window: timedelta = timedelta(hours=12),
+        jitter: float = 0.2,
+    ):
+        self.collection = collection
+        self.schedule_collection = schedule_collection
+        self.name = name
+        self.query = query or {}
+        self.field = field
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_per_run = target_per_run
+        self.window = window
+        self.jitter = jitter
+        self.collection.create_index(
+            [*((key, ASCENDING) for key in self.query), (field, ASCENDING)]
+        )
+
+    def rate(self) -> float:
+        """Matching documents per second over the window."""
+        # Timestamps are stored as UTC ISO strings, which sort like the times they hold
+        since = (datetime.now(timezone.utc) - self.window).isoformat()
+        count = self.collection.count_documents(
+            {**self.query, self.field: {"$gte": since}}
+        )
+        return count / self.window.total_seconds()
+
+    def next_interval(self, backoff: int = 0) -> float:
+        """Seconds until the next run. ``backoff`` counts consecutive failures."""
+        rate = self.rate()
+        if backoff:
+            interval = self.min_interval * 2**backoff
+        elif rate > 0:
+            interval = self.target_per_run / rate
+        else:
+            interval = self.max_interval
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+
+        now = datetime.now(timezone.utc)
+        self.schedule_collection.update_one(
+            {"_id": self.name},
+            {
+                "$set": {
+                    "rate_per_hour": rate * 3600,
+                    "interval": interval,
+                    "failures": backoff,
+                    "updated_at": now,
+                    "next_run_at": now + timedelta(seconds=interval),
+                }
+            },
+            upsert=True,
+        )
+        return interval
+
+    def sleep(self, backoff: int = 0):
+        duration = self.next_interval(backoff)
+        logging.info(
+            "%s: sleeping for %d minutes, %d seconds...",
+            self.name,
+            duration // 60,
+            duration % 60,
+        )
+        time.sleep(duration)
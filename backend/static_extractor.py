@@ -0,0 +1,134 @@
+import logging
+import threading
+import urllib.parse
+from collections import Counter
+from enum import Enum
+from typing import Optional
+
+import requests
+from pymongo.database import Collection
+from requests.adapters import HTTPAdapter
+
+from structs import PageContent, PageMetadata
+
+
+class Tier(Enum):
+    Static = "static"
+    Browser = "browser"
+
+
+class StaticExtractor:
+    """Reads server-rendered articles over plain HTTP before falling back to Chromium.
+
+    Remembers per domain which tier produced usable text, so domains that
+    need a browser stop paying for the static fetch. A domain moves to the
+    browser after ``demote_after`` static misses in a row, so one short
+    brief doesn't send it there, and every ``reprobe`` browser parses the
+    static tier gets another chance. Pages that an
+    earlier stage already downloaded into ``html_collection`` are read
+    from there instead of being fetched again.
+    """
+
+    session: requests.Session
+    html_collection: Optional[Collection]
+    min_length: int
+    timeout: float
+    reprobe: int
+    demote_after: int
+    domain_tiers: dict[str, Tier]
+    browser_streaks: Counter
+    static_misses: Counter
+    stats: Counter
+
+    def __init__(
+        self,
+        min_length: int = 500,
+        timeout: float = 15,
+        pool_size: int = 20,
+        reprobe: int = 20,
+        demote_after: int = 3,
+        html_collection: Optional[Collection] = None,
+    ):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "Dolores/1.0"
+        self.html_collection = html_collection
+        self.min_length = min_length
+        self.timeout = timeout
+        self.reprobe = reprobe
+        self.demote_after = demote_after
+        self.domain_tiers = {}
+        self.browser_streaks = Counter()
+        self.static_misses = Counter()
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def should_try(self, url: str) -> bool:
+        domain = domain_of(url)
+        with self.lock:
+            if self.domain_tiers.get(domain) != Tier.Browser:
+                return True
+            return self.browser_streaks[domain] % self.reprobe == 0
+
+    def extract(self, metadata: PageMetadata) -> Optional[PageContent]:
+        """Returns the page content, or None if the page needs a browser."""
+        domain = domain_of(metadata.url)
+        try:
+            page_content = PageContent.from_html(metadata, self.fetch(metadata))
+        except Exception as e:
+            logging.warning("Static fetch failed for %s: %s", metadata.url, e)
+            page_content = None
+
+        if page_content and len(page_content.text.strip()) >= self.min_length:
+            with self.lock:
+                self.domain_tiers[domain] = Tier.Static
+                self.browser_streaks[domain] = 0
+                self.static_misses[domain] = 0
+                self.stats[Tier.Static] += 1
+            logging.info("Static parse complete: %s", metadata.url)
+            return page_content
+
+        logging.info("Escalating to browser: %s", metadata.url)
+        with self.lock:
+            self.static_misses[domain] += 1
+            # A failed reprobe keeps the domain where it was
+            if self.static_misses[domain] >= self.demote_after:
+                self.domain_tiers[domain] = Tier.Browser
+        return None
+
+    def fetch(self, metadata: PageMetadata) -> str:
+        if self.html_collection is not None:
+            cached = self.html_collection.find_one({"_id": metadata._id})
+            if cached:
+                with self.lock:
+                    self.stats["prefetched"] += 1
+                return cached["html"]
+
+        response = self.session.get(metadata.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def record_browser(self, url: str):
+        with self.lock:
+            self.browser_streaks[domain_of(url)] += 1
+            self.stats[Tier.Browser] += 1
+
+    def log(self, logger: logging.Logger):
+        with self.lock:
+            static = [d for d, t in self.domain_tiers.items() if t == Tier.Static]
+            browser = [d for d, t in self.domain_tiers.items() if t == Tier.Browser]
+            logger.info(
+                "Extraction tiers: %d static (%d prefetched), %d browser; "
+                "static domains %s, browser domains %s",
+                self.stats[Tier.Static],
+                self.stats["prefetched"],
+                self.stats[Tier.Browser],
+                static,
+                browser,
+            )
+
+
+def domain_of(url: str) -> str:
+    return urllib.parse.urlparse(url).hostname or ""
@@ -1,57 +1,388 @@
 import argparse
+import dataclasses
 import logging
+import math
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from itertools import combinations
+from typing import Optional
 
-from pymongo import MongoClient
+from pymongo import ASCENDING, InsertOne, MongoClient, ReplaceOne, UpdateOne
 from pymongo.database import Collection
-from structs import Analysis
+from change_feed import ChangeFeed
+from schedule import AdaptiveSchedule
+from structs import Story
+
+
+class UnionFind:
+    parents: dict[str, str]
+
+    def __init__(self):
+        self.parents = {}
+
+    def find(self, item: str) -> str:
+        parent = self.parents.setdefault(item, item)
+        if parent != item:
+            parent = self.parents[item] = self.find(parent)
+        return parent
+
+    def union(self, a: str, b: str):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # Keep the smaller ID as the root so story IDs are stable
+            self.parents[max(root_a, root_b)] = min(root_a, root_b)
 
 
 class StoryAggregator:
+    """Groups analyses that share search terms into stories.
+
+    Only pairs of articles that appear together in at least one posting of
+    the term index are ever compared, and terms that appear in too many
+    articles to say anything about a story are left out of the index.
+
+    The index (``term_collection``) and each article's story
+    (``member_collection``) are persisted. After the first full pass, each
+    cycle only merges analyses added since the feed's watermark, and drops
+    stories that have had no new article within ``window``.
+    """
+
     analysis_collection: Collection
+    story_collection: Collection
+    member_collection: Collection
+    term_collection: Collection
+    feed: ChangeFeed
+    schedule: AdaptiveSchedule
+    threshold: float
+    max_document_frequency: float
+    min_postings_cap: int
+    window: timedelta
 
-    def __init__(self, analysis_collection: Collection) -> None:
+    def __init__(
+        self,
+        analysis_collection: Collection,
+        story_collection: Collection,
+        member_collection: Collection,
+        term_collection: Collection,
+        feed: ChangeFeed,
+        schedule: AdaptiveSchedule,
+        threshold: float = 0.3,
+        max_document_frequency: float = 0.05,
+        min_postings_cap: int = 10,
+        window: timedelta = timedelta(days=7),
+    ) -> None:
         self.analysis_collection = analysis_collection
+        self.story_collection = story_collection
+        self.member_collection = member_collection
+        self.term_collection = term_collection
+        self.feed = feed
+        self.schedule = schedule
+        self.threshold = threshold
+        self.max_document_frequency = max_document_frequency
+        self.min_postings_cap = min_postings_cap
+        self.window = window
+        self.member_collection.create_index([("story_id", ASCENDING)])
 
-    def loop(self):
-        logging.info("Starting Aggregator Loop")
-        while True:
-            # Sleep for 2 to 5 minutes
-            # duration = random.randint(60 * 2, 60 * 5)
-            # logging.info(
-            #     "Sleeping for %d minutes, %d seconds...", duration // 60, duration % 60
-            # )
-            # time.sleep(duration)
+    def build_index(
+        self,
+    ) -> tuple[dict[str, set[str]], dict[str, set[str]], dict[str, Optional[str]]]:
+        terms_by_article: dict[str, set[str]] = {}
+        analyzed_at: dict[str, Optional[str]] = {}
+        index: dict[str, set[str]] = defaultdict(set)
+        for analysis in self.analysis_collection.find(
+            {}, projection={"search_terms": 1, "analyzed_at": 1}
+        ):
+            terms = {term.lower() for term in analysis.get("search_terms", [])}
+            terms_by_article[analysis["_id"]] = terms
+            analyzed_at[analysis["_id"]] = analysis.get("analyzed_at")
+            for term in terms:
+                index[term].add(analysis["_id"])
+        return terms_by_article, index, analyzed_at
+
+    def weight(self, article_count: int, postings: int) -> float:
+        return math.log(article_count / max(postings, 1)) + 1
+
+    def max_postings(self, article_count: int) -> int:
+        # In a small corpus, a story covered by a handful of sources is
+        # itself a large fraction of the articles; don't drop its terms
+        return max(
+            self.min_postings_cap, int(article_count * self.max_document_frequency)
+        )
+
+    def score_pairs(
+        self, terms_by_article: dict[str, set[str]], index: dict[str, set[str]]
+    ) -> dict[tuple[str, str], float]:
+        article_count = len(terms_by_article)
+        max_postings = self.max_postings(article_count)
+        weights = {
+            term: self.weight(article_count, len(ids)) for term, ids in index.items()
+        }
+
+        shared: Counter = Counter()
+        for term, ids in index.items():
+            if len(ids) < 2 or len(ids) > max_postings:
+                continue
+            for pair in combinations(sorted(ids), 2):
+                shared[pair] += weights[term]
+
+        # IDF-weighted Jaccard: rare shared terms count for more than common ones
+        totals = {
+            article: sum(weights[term] for term in terms)
+            for article, terms in terms_by_article.items()
+        }
+        return {
+            (a, b): weight / (totals[a] + totals[b] - weight)
+            for (a, b), weight in shared.items()
+        }
 
-            # Analyze page content that's not part of a story
-            for this_analysis_struct in self.analysis_collection.find():
-                this_analysis = Analysis(**this_analysis_struct)
+    def bootstrap(self):
+        """Clusters every analysis at once and persists the index it was built from."""
+        start = time.monotonic()
+        terms_by_article, index, analyzed_at = self.build_index()
+        scores = self.score_pairs(terms_by_article, index)
 
-                common_subjects_article_dict = {}
+        clusters = UnionFind()
+        for (a, b), score in scores.items():
+            if score >= self.threshold:
+                clusters.union(a, b)
 
-                for other_analysis_Struct in self.analysis_collection.find():
-                    other_analysis = Analysis(**other_analysis_Struct)
+        # Older analyses have no timestamp; start their window now
+        now = datetime.now(timezone.utc).isoformat()
+        self.member_collection.delete_many({})
+        self.term_collection.delete_many({})
+        if terms_by_article:
+            self.member_collection.bulk_write(
+                [
+                    InsertOne(
+                        {
+                            "_id": article,
+                            "story_id": clusters.find(article),
+                            "terms": sorted(terms),
+                            "analyzed_at": analyzed_at[article] or now,
+                        }
+                    )
+                    for article, terms in terms_by_article.items()
+                ],
+                ordered=False,
+            )
+            self.term_collection.bulk_write(
+                [
+                    InsertOne({"_id": term, "article_ids": sorted(ids)})
+                    for term, ids in index.items()
+                ],
+                ordered=False,
+            )
 
-                    if this_analysis._id == other_analysis._id:
-                        continue
+        members: dict[str, list[str]] = defaultdict(list)
+        for article in terms_by_article:
+            members[clusters.find(article)].append(article)
 
-                    this_subjects = set(this_analysis.subjects)
-                    other_subjects = set(other_analysis.subjects)
+        stories = [
+            Story.from_articles(
+                root,
+                articles,
+                terms_by_article,
+                max(analyzed_at[a] or now for a in articles),
+            )
+            for root, articles in members.items()
+            if len(articles) > 1
+        ]
+        self.save(stories)
+        logging.info(
+            "Clustered %d articles into %d stories from %d candidate pairs in %.1fs",
+            len(terms_by_article),
+            len(stories),
+            len(scores),
+            time.monotonic() - start,
+        )
 
-                    common_subjects = this_subjects.intersection(other_subjects)
-                    common_subjects_article_dict[other_analysis._id] = common_subjects
+    def save(self, stories: list[Story]):
+        if stories:
+            self.story_collection.bulk_write(
+                [
+                    ReplaceOne({"_id": story._id}, dataclasses.asdict(story), upsert=True)
+                    for story in stories
+                ],
+                ordered=False,
+            )
+        self.story_collection.delete_many(
+            {"_id": {"$nin": [story._id for story in stories]}}
+        )
 
-                    if common_subjects:
-                        logging.info(
-                            "[%s + %s] = %s",
-                            this_analysis.takeaways[0],
-                            other_analysis.takeaways[0],
-                            common_subjects,
-                        )
+    def matches(self, article: str, terms: set[str]) -> list[str]:
+        """Returns the already clustered articles similar enough to join ``article``."""
+        article_count = self.member_collection.estimated_document_count() + 1
+        max_postings = self.max_postings(article_count)
+        postings = {
+            posting["_id"]: posting["article_ids"]
+            for posting in self.term_collection.find({"_id": {"$in": list(terms)}})
+        }
+        # The new article itself will be one more posting for each of its terms
+        weights = {
+            term: self.weight(article_count, len(postings.get(term, [])) + 1)
+            for term in terms
+        }
+
+        shared: Counter = Counter()
+        for term, ids in postings.items():
+            if len(ids) + 1 > max_postings:
+                continue
+            for other in ids:
+                shared[other] += weights[term]
+        if not shared:
+            return []
+
+        candidates = {
+            member["_id"]: member["terms"]
+            for member in self.member_collection.find(
+                {"_id": {"$in": list(shared)}}, projection={"terms": 1}
+            )
+        }
+        candidate_terms = {term for terms in candidates.values() for term in terms}
+        for posting in self.term_collection.aggregate(
+            [
+                {"$match": {"_id": {"$in": list(candidate_terms - terms)}}},
+                {"$project": {"size": {"$size": "$article_ids"}}},
+            ]
+        ):
+            weights[posting["_id"]] = self.weight(article_count, posting["size"])
+
+        total = sum(weights[term] for term in terms)
+        matches = []
+        for other, weight in shared.items():
+            if other not in candidates:
+                continue
+            other_total = sum(weights.get(t, 1.0) for t in candidates[other])
+            if weight / (total + other_total - weight) >= self.threshold:
+                matches.append(other)
+        return matches
+
+    def ingest(self, analysis: dict):
+        article = analysis["_id"]
+        if self.member_collection.find_one({"_id": article}, projection={"_id": 1}):
+            return
+
+        terms = {term.lower() for term in analysis.get("search_terms", [])}
+        matches = self.matches(article, terms)
+
+        # Union the new article's story with every story it matched
+        story_ids = {article} | {
+            member["story_id"]
+            for member in self.member_collection.find(
+                {"_id": {"$in": matches}}, projection={"story_id": 1}
+            )
+        }
+        root = min(story_ids)
+        merged = list(story_ids - {article})
+        if merged:
+            self.member_collection.update_many(
+                {"story_id": {"$in": merged}}, {"$set": {"story_id": root}}
+            )
+        self.member_collection.insert_one(
+            {
+                "_id": article,
+                "story_id": root,
+                "terms": sorted(terms),
+                "analyzed_at": analysis.get("analyzed_at")
+                or datetime.now(timezone.utc).isoformat(),
+            }
+        )
+        if terms:
+            self.term_collection.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": term}, {"$addToSet": {"article_ids": article}}, upsert=True
+                    )
+                    for term in terms
+                ],
+                ordered=False,
+            )
+        self.story_collection.delete_many({"_id": {"$in": list(story_ids - {root})}})
+        self.refresh_story(root)
+
+    def refresh_story(self, story_id: str):
+        members = list(self.member_collection.find({"story_id": story_id}))
+        if len(members) < 2:
+            self.story_collection.delete_one({"_id": story_id})
+            return
+
+        story = Story.from_articles(
+            story_id,
+            [member["_id"] for member in members],
+            {member["_id"]: set(member["terms"]) for member in members},
+            max(member["analyzed_at"] for member in members),
+        )
+        self.story_collection.replace_one(
+            {"_id": story_id}, dataclasses.asdict(story), upsert=True
+        )
+
+    def expire(self):
+        cutoff = (datetime.now(timezone.utc) - self.window).isoformat()
+        stale = [
+            story["_id"]
+            for story in self.member_collection.aggregate(
+                [
+                    {"$group": {"_id": "$story_id", "latest": {"$max": "$analyzed_at"}}},
+                    {"$match": {"latest": {"$lt": cutoff}}},
+                ]
+            )
+        ]
+        if not stale:
+            return
+
+        members = list(
+            self.member_collection.find(
+                {"story_id": {"$in": stale}}, projection={"terms": 1}
+            )
+        )
+        article_ids = [member["_id"] for member in members]
+        terms = list({term for member in members for term in member["terms"]})
+        self.term_collection.update_many(
+            {"_id": {"$in": terms}}, {"$pull": {"article_ids": {"$in": article_ids}}}
+        )
+        self.term_collection.delete_many({"article_ids": {"$size": 0}})
+        self.member_collection.delete_many({"_id": {"$in": article_ids}})
+        self.story_collection.delete_many({"_id": {"$in": stale}})
+        logging.info("Expired %d stories of %d articles", len(stale), len(article_ids))
+
+    def loop(self):
+        logging.info("Starting Aggregator Loop")
+        if self.member_collection.estimated_document_count() == 0:
+            self.bootstrap()
+
+        while True:
+            start = time.monotonic()
+            analyses = self.feed.read_new()
+            for analysis in analyses:
+                self.ingest(analysis)
+                self.feed.advance(analysis)
+            self.expire()
+            logging.info(
+                "Merged %d new analyses in %.1fs", len(analyses), time.monotonic() - start
+            )
+            self.schedule.sleep()
 
 
 def main():
     parser = argparse.ArgumentParser(description="Story Aggregator")
-    parser.parse_args()
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.3,
+        help="Weighted Jaccard similarity needed to put two articles in a story",
+    )
+    parser.add_argument(
+        "--window-days",
+        type=float,
+        default=7,
+        help="Days without a new article before a story is dropped",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recluster every analysis from scratch before following new ones",
+    )
+    args = parser.parse_args()
 
     logging.basicConfig(format="%(asctime)s | %(levelname)-7s | %(message)s")
     logging.getLogger().setLevel(logging.INFO)
@@ -59,10 +390,31 @@ def main():
     # Connect to MongoDB
     client = MongoClient("mongodb://localhost:27017/")
     db = client.dolores
-    page_collection = db.pages
-    analysis_collection = db.analyses
+    analysis_collection = db.page_analysis
+    story_collection = db.stories
+
+    # Created before any bootstrap, so analyses added meanwhile are merged after it
+    feed = ChangeFeed(analysis_collection, db.pipeline_state, "stories", "analyzed_at")
 
-    analyzer = StoryAggregator(analysis_collection)
+    analyzer = StoryAggregator(
+        analysis_collection,
+        story_collection,
+        db.story_members,
+        db.story_terms,
+        feed,
+        AdaptiveSchedule(
+            analysis_collection,
+            db.schedule,
+            "stories",
+            min_interval=60,
+            max_interval=60 * 10,
+            field="analyzed_at",
+        ),
+        args.threshold,
+        window=timedelta(days=args.window_days),
+    )
+    if args.rebuild:
+        analyzer.bootstrap()
     analyzer.loop()
 
 
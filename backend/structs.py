@@ -2,45 +2,75 @@ import dataclasses
 import logging
 from datetime import datetime, timezone
 from dateutil.parser import parse as parse_date
-from playwright.sync_api import Page, sync_playwright
+from playwright.async_api import Page as AsyncPage
+from playwright.sync_api import Page
 from pydantic import BaseModel
+from navigation import goto, goto_async
+from urls import canonicalize_url
 import html
+import urllib.parse
+from bs4 import BeautifulSoup, Tag
+from typing import Optional
+from collections import Counter
 
 
-def get_favicon_url(page) -> str:
-    return page.evaluate(
-        """() => {
-        const link = document.querySelector('link[rel="icon"], link[rel="shortcut icon"]');
-        if (link) {
-            const href = link.href;
-            if (href.startsWith('http')) {
-                return href;
-            } else if (href.startsWith('/')) {
-                const urlObj = new URL(document.location.href);
-                return urlObj.protocol + '//' + urlObj.host + href;
-            } else {
-                return document.location.href + '/' + href;
-            }
-        }
-        return null;
-    }"""
-    )
+# Everything we read from a rendered page, collected in a single round-trip
+EXTRACT_SCRIPT = """() => {
+    const meta = (selector) => {
+        const element = document.querySelector(selector);
+        return element ? element.getAttribute('content') : null;
+    };
 
+    const article = document.querySelector('article');
+    const root = article && article.querySelector('p') ? article : document;
+    const paragraphs = Array.from(root.querySelectorAll('p'), (p) => p.textContent);
 
-def get_text_by_classname(page: Page) -> str:
-    base = page.locator("p")
+    const icon = document.querySelector('link[rel="icon"], link[rel="shortcut icon"]');
+    const canonical = document.querySelector('link[rel="canonical"]');
 
-    if page.get_by_role("article"):
-        article = page.get_by_role("article")
-        if article.get_by_role("paragraph"):
-            base = page.get_by_role("paragraph")
+    const og = {};
+    for (const element of document.querySelectorAll('meta[property^="og:"]')) {
+        og[element.getAttribute('property').slice(3)] = element.getAttribute('content');
+    }
 
-    all_text = []
-    for match in base.all():
-        text = match.text_content()
-        all_text.append(text)
+    return {
+        paragraphs: paragraphs,
+        favicon_url: icon ? icon.href : null,
+        canonical_url: canonical ? canonical.href : null,
+        author: meta('meta[name="author"]') || meta('meta[property="article:author"]'),
+        og: og,
+    };
+}"""
 
-    return "\n\n".join(all_text)
+
+def get_favicon_url_from_soup(soup: BeautifulSoup, url: str) -> Optional[str]:
+    link = soup.find("link", rel=lambda rel: rel in ("icon", "shortcut icon"))
+    if not isinstance(link, Tag) or not link.get("href"):
+        return None
+    return urllib.parse.urljoin(url, str(link["href"]))
+
+
+def get_text_from_soup(soup: BeautifulSoup) -> str:
+    base = soup
+    article = soup.find("article")
+    if isinstance(article, Tag) and article.find("p"):
+        base = article
+
+    return "\n\n".join(p.get_text() for p in base.find_all("p"))
+
+
+def get_meta_content(soup: BeautifulSoup, **attrs) -> Optional[str]:
+    tag = soup.find("meta", attrs=attrs)
+    if isinstance(tag, Tag) and tag.get("content"):
+        return str(tag["content"])
+    return None
+
+
+def get_og_from_soup(soup: BeautifulSoup) -> dict[str, str]:
+    og = {}
+    for tag in soup.find_all("meta", property=lambda p: p and p.startswith("og:")):
+        og[str(tag["property"])[3:]] = str(tag.get("content", ""))
+    return og
 
 
 @dataclasses.dataclass
@@ -51,6 +81,8 @@ class PageMetadata:
     url: str
     date: str
     discussion_url: str
+    # When this article entered the pipeline, used to follow new articles
+    ingested_at: Optional[str] = None
 
     @staticmethod
     def from_raw(
@@ -63,15 +95,16 @@ class PageMetadata:
         title = html.unescape(title)
         date = parse_date(date).astimezone(timezone.utc).isoformat()
         source = source
-        url = url
 
         return PageMetadata(
-            _id=url,
+            # Canonical only for deduplication; pages are fetched from the URL as given
+            _id=canonicalize_url(url),
             source=source,
             title=title,
             url=url,
             date=date,
-            discussion_url=discussion_url
+            discussion_url=discussion_url,
+            ingested_at=datetime.now(timezone.utc).isoformat(),
         )
 
     def published_after(self, cmp_date: datetime) -> bool:
@@ -83,28 +116,64 @@ class PageContent:
     _id: str
     text: str
     favicon_url: str
+    canonical_url: Optional[str] = None
+    author: Optional[str] = None
+    og: dict[str, str] = dataclasses.field(default_factory=dict)
+    # MinHash signature and LSH band keys, see near_duplicates.py
+    minhash: list[int] = dataclasses.field(default_factory=list)
+    lsh_bands: list[str] = dataclasses.field(default_factory=list)
+    duplicate_of: Optional[str] = None
+
+    @staticmethod
+    def from_metadata(metadata: PageMetadata, page: Page, lightweight: bool = True):
+        # Navigation errors propagate, so the pool recycles the page
+        logging.info("Parsing %s", metadata.url)
+        goto(page, metadata.url, lightweight)
+
+        extraction = page.evaluate(EXTRACT_SCRIPT)
+        page_content = PageContent.from_extraction(metadata, extraction)
+        logging.info("Parse complete: %s", metadata.url)
+        return page_content
 
     @staticmethod
-    def from_metadata(metadata: PageMetadata):
+    async def from_metadata_async(
+        metadata: PageMetadata, page: AsyncPage, timeout: float, lightweight: bool = True
+    ):
         logging.info("Parsing %s", metadata.url)
-        with sync_playwright() as p:
-            browser = p.chromium.launch()
-            page = browser.new_page()
-            try:
-                page.goto(metadata.url)
-            except Exception as e:
-                logging.error("Failed to parse %s: %s", metadata.url, e)
-                return None
-
-            favicon_url = get_favicon_url(page)
-            page_text: str = get_text_by_classname(page)
-            page_content = PageContent(
-                metadata.url,
-                page_text,
-                favicon_url,
-            )
-            logging.info("Parse complete: %s", metadata.url)
-            return page_content
+        await goto_async(page, metadata.url, lightweight, timeout)
+
+        extraction = await page.evaluate(EXTRACT_SCRIPT)
+        page_content = PageContent.from_extraction(metadata, extraction)
+        logging.info("Parse complete: %s", metadata.url)
+        return page_content
+
+    @staticmethod
+    def from_extraction(metadata: PageMetadata, extraction: dict):
+        return PageContent(
+            metadata._id,
+            "\n\n".join(extraction["paragraphs"]),
+            extraction["favicon_url"],
+            extraction["canonical_url"],
+            extraction["author"],
+            extraction["og"],
+        )
+
+    @staticmethod
+    def from_html(metadata: PageMetadata, html_text: str):
+        soup = BeautifulSoup(html_text, features="html.parser")
+        canonical = soup.find("link", rel="canonical")
+        canonical_url = None
+        if isinstance(canonical, Tag) and canonical.get("href"):
+            canonical_url = urllib.parse.urljoin(metadata.url, str(canonical["href"]))
+        return PageContent(
+            metadata._id,
+            get_text_from_soup(soup),
+            get_favicon_url_from_soup(soup, metadata.url),
+            canonical_url,
+            get_meta_content(soup, name="author")
+            or get_meta_content(soup, property="article:author"),
+            get_og_from_soup(soup),
+        )
 
 
 class LlmAnalysis(BaseModel):
@@ -117,6 +186,8 @@ class Analysis:
     _id: str
     takeaways: list[str]
     search_terms: list[str]
+    analyzed_at: Optional[str] = None
+    duplicate_of: Optional[str] = None
 
     @staticmethod
     def from_llm_analysis(id: str, llm_analysis: LlmAnalysis):
@@ -124,4 +195,41 @@ class Analysis:
             _id=id,
             takeaways=llm_analysis.takeaways,
             search_terms=list(llm_analysis.search_terms),
+            analyzed_at=datetime.now(timezone.utc).isoformat(),
+        )
+
+    @staticmethod
+    def from_original(id: str, original: dict):
+        return Analysis(
+            _id=id,
+            takeaways=original["takeaways"],
+            search_terms=original["search_terms"],
+            analyzed_at=datetime.now(timezone.utc).isoformat(),
+            duplicate_of=original["_id"],
+        )
+
+
+@dataclasses.dataclass
+class Story:
+    _id: str
+    article_ids: list[str]
+    search_terms: list[str]
+    updated_at: Optional[str] = None
+
+    @staticmethod
+    def from_articles(
+        id: str,
+        article_ids: list[str],
+        terms_by_article: dict[str, set[str]],
+        updated_at: Optional[str] = None,
+    ):
+        # Terms shared by at least two of the story's articles describe it best
+        counts = Counter(
+            term for article in article_ids for term in terms_by_article[article]
+        )
+        return Story(
+            _id=id,
+            article_ids=sorted(article_ids),
+            search_terms=[term for term, count in counts.most_common() if count > 1],
+            updated_at=updated_at,
         )
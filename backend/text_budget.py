@@ -0,0 +1,68 @@
+import re
+
+# Close enough for English prose with most tokenizers, and free to compute
+CHARS_PER_TOKEN = 4
+
+BOILERPLATE = re.compile(
+    # Whole paragraphs that are nothing but a label...
+    r"^(advertisement|sponsored|related:?|read more|share this|comments?)$|"
+    # ...or that open with a known boilerplate phrase. Anchored to the phrase,
+    # so news about cookies or newsletters is kept
+    r"^(we use cookies|this (web)?site uses cookies|accept (all )?cookies|"
+    r"(sign up|subscribe) (for|to) (our|the) [\w ]*newsletter|follow us on|"
+    r"all rights reserved)\b|^(copyright )?©",
+    re.IGNORECASE,
+)
+# Paragraphs of boilerplate are short; real paragraphs that mention cookies aren't
+BOILERPLATE_MAX_LENGTH = 200
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def strip_boilerplate(text: str) -> list[str]:
+    """Returns the article's paragraphs without empty, repeated or boilerplate ones."""
+    seen = set()
+    paragraphs = []
+    for paragraph in text.split("\n\n"):
+        paragraph = re.sub(r"\s+", " ", paragraph).strip()
+        if not paragraph or paragraph in seen:
+            continue
+        seen.add(paragraph)
+        if len(paragraph) < BOILERPLATE_MAX_LENGTH and BOILERPLATE.match(paragraph):
+            continue
+        paragraphs.append(paragraph)
+    return paragraphs
+
+
+def chunk(paragraphs: list[str], budget: int) -> list[str]:
+    """Packs paragraphs, in order, into chunks of at most ``budget`` tokens.
+
+    A single paragraph over budget is split on sentence boundaries, and cut
+    hard if a single sentence is still too long.
+    """
+    chunks: list[str] = []
+    current: list[str] = []
+    current_tokens = 0
+
+    pieces: list[str] = []
+    for paragraph in paragraphs:
+        if estimate_tokens(paragraph) <= budget:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            limit = budget * CHARS_PER_TOKEN
+            pieces.extend(sentence[i : i + limit] for i in range(0, len(sentence), limit))
+
+    for piece in pieces:
+        tokens = estimate_tokens(piece + "\n\n")
+        if current and current_tokens + tokens > budget:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
@@ -0,0 +1,107 @@
+import re
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+from pymongo.database import Collection
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {
+    "fbclid",
+    "gclid",
+    "dclid",
+    "msclkid",
+    "mc_cid",
+    "mc_eid",
+    "igshid",
+    "ref_src",
+    "cmpid",
+    "__twitter_impression",
+}
+# Sites whose AMP page is the article's URL on an amp. host, with an /amp or
+# .amp suffix, or with an amp query parameter. Elsewhere those can be part
+# of a different article's URL
+AMP_PUBLISHERS = {
+    "arstechnica.com",
+    "bbc.co.uk",
+    "bbc.com",
+    "engadget.com",
+    "hackaday.com",
+    "osnews.com",
+    "techradar.com",
+    "technologyreview.com",
+    "theguardian.com",
+    "theverge.com",
+    "xda-developers.com",
+}
+AMP_PARAMS = {"amp", "outputtype"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize_url(url: str) -> str:
+    """Maps the variants of an article URL that we see in feeds to a single form.
+
+    Drops tracking parameters, fragments, default ports, www. hosts, the AMP
+    forms of known publishers and trailing slashes, and treats http and https
+    as the same page.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    if parts.scheme not in DEFAULT_PORTS or not parts.hostname:
+        return url
+
+    host = re.sub(r"^www\.", "", parts.hostname.lower())
+    amp = re.sub(r"^amp\.", "", host) in AMP_PUBLISHERS
+    if amp:
+        host = re.sub(r"^amp\.", "", host)
+    if parts.port and parts.port not in DEFAULT_PORTS.values():
+        host = f"{host}:{parts.port}"
+
+    path = re.sub(r"/+", "/", parts.path)
+    if amp:
+        path = re.sub(r"/amp/?$", "/", path)
+        path = re.sub(r"\.amp(\.html?)?$", r"\1", path)
+    path = path.rstrip("/")
+
+    query = urllib.parse.urlencode(
+        sorted(
+            (key, value)
+            for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith("utm_")
+            and key.lower() not in TRACKING_PARAMS
+            and not (amp and key.lower() in AMP_PARAMS)
+        )
+    )
+
+    return urllib.parse.urlunsplit(("https", host, path, query, ""))
+
+
+class SeenUrls:
+    """The most recently seen canonical URLs, so repeats are dropped before any DB write."""
+
+    capacity: int
+    urls: OrderedDict
+
+    def __init__(self, capacity: int = 100_000):
+        self.capacity = capacity
+        self.urls = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, url: str) -> bool:
+        with self.lock:
+            if url not in self.urls:
+                return False
+            self.urls.move_to_end(url)
+            return True
+
+    def add(self, url: str):
+        with self.lock:
+            self.urls[url] = None
+            self.urls.move_to_end(url)
+            while len(self.urls) > self.capacity:
+                self.urls.popitem(last=False)
+
+    def warm(self, collection: Collection):
+        # Most recent last, so they are the last to be evicted
+        recent = collection.find({}, projection={"_id": 1}).sort("ingested_at", -1)
+        for document in reversed(list(recent.limit(self.capacity))):
+            self.add(document["_id"])
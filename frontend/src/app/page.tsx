@@ -11,7 +11,9 @@ interface Article {
   source: string,
   date: string,
   text: string,
-  discussion_url: string
+  discussion_url: string,
+  analyzed_at: string,
+  duplicate_of?: string
 }
 
 function sleep(ms: number): Promise<void> {
@@ -78,27 +80,51 @@ const App = () => {
     }
   }
 
-  const get_all_articles = async () => {
-    console.log("Getting all articles...");
-    const articles: Array<Article> = await get_json_retry(url + "/all");
-
-    articles.sort((a, b) => {
+  const sortArticles = (articles: Array<Article>) => {
+    return articles.sort((a, b) => {
       const dateA = new Date(a.date);
       const dateB = new Date(b.date);
       return dateA.getTime() - dateB.getTime(); // Sort in descending order
     });
+  }
 
-    var new_sources = new Set<string>();
-    for (const story of articles) {
-      new_sources.add(story.source)
-    }
+  const get_all_articles = async () => {
+    console.log("Getting all articles...");
+    const articles: Array<Article> = await get_json_retry(url + "/all");
+    setArticles(sortArticles(articles));
 
-    setArticles(articles);
-    setTimeout(get_all_articles, 10000);
+    // Everything analyzed after the newest article we have arrives as an event
+    const latest = articles.reduce((max, a) => a.analyzed_at > max ? a.analyzed_at : max, "");
+    return new EventSource(url + "/stream?text=1&after=" + encodeURIComponent(latest));
   }
 
   useEffect(() => {
-    get_all_articles();
+    let events: EventSource | null = null;
+    let closed = false;
+    get_all_articles().then((source) => {
+      if (closed) {
+        source.close();
+        return;
+      }
+      events = source;
+      events.onmessage = (message) => {
+        const article: Article = JSON.parse(message.data);
+        // Near-duplicates are listed under their original, not on their own
+        if (article.duplicate_of) {
+          return;
+        }
+        setArticles((articles) => {
+          if (articles.some((a) => a._id == article._id)) {
+            return articles;
+          }
+          return sortArticles([...articles, article]);
+        });
+      };
+    });
+    return () => {
+      closed = true;
+      events?.close();
+    };
   }, []);
 
   const selectArticle = (article: Article) => {